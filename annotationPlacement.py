@@ -0,0 +1,78 @@
+import bisect
+from records import Record
+
+# A lightweight view of an annotation with a composite id, it carries one of the ids and shares the span with the original annotation
+class AnnotationView(Record):
+    __slots__ = ('annotation', 'id')
+
+    def __init__(self, annotation, id):
+        self.annotation = annotation                            # Original annotation with the composite id
+        self.id = id                                            # One of the ids of the composite id
+
+    @property
+    def pmid(self):
+        return self.annotation.pmid
+
+    @property
+    def start(self):
+        return self.annotation.start
+
+    @property
+    def end(self):
+        return self.annotation.end
+
+    @property
+    def text(self):
+        return self.annotation.text
+
+    @property
+    def type(self):
+        return self.annotation.type
+
+    @property
+    def others(self):
+        return self.annotation.others
+
+    def __str__(self):
+        return '%s\t%s\t%s\t%s\t%s\t%s' % (self.pmid, self.start, self.end, self.text, self.type, self.id)
+
+# An index of the sentences of a document sorted by position, used to find the sentence that contains an annotation
+class SentenceIndex:
+    def __init__(self, sentences):
+        self.sentences = sentences                              # Sentences of the document in order
+        self.sentenceStarts = [sen.start for sen in sentences]  # Starting indices of the sentences
+
+    # Returns the index of the sentence that contains the annotation, or -1 if no sentence contains it
+    def find(self, ann):
+        # The only sentence that can contain the annotation is the last one starting before it
+        i = bisect.bisect_right(self.sentenceStarts, ann.start) - 1
+        if i < 0 or ann.end > self.sentences[i].end:
+            return -1
+        return i
+
+    # Returns the (start, end) character range of the sentences containing the annotations, extended by margin sentences on both sides
+    def window(self, annotations, margin):
+        indices = [self.find(ann) for ann in annotations]
+        first = max(min(indices) - margin, 0)
+        last = min(max(indices) + margin, len(self.sentences) - 1)
+        return self.sentences[first].start, self.sentences[last].end
+
+# Function to add every annotation to the sentence that contains it, using binary search over the sorted sentence starts
+def placeAnnotations(sentences, annotations, splitCompositeIDs=True):
+    sentenceIndex = SentenceIndex(sentences)
+
+    for ann in annotations:
+        if ann.id == '-1':
+            continue
+        i = sentenceIndex.find(ann)
+        if i < 0:
+            continue
+
+        ids = ann.id.split('|') if splitCompositeIDs else [ann.id]
+        if len(ids) > 1:
+            for splitID in ids:
+                sentences[i].addAnnotation(AnnotationView(ann, splitID))
+        else:
+            sentences[i].addAnnotation(ann)
+
+    return sentenceIndex
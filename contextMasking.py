@@ -0,0 +1,88 @@
+from records import Record
+
+MASK_TOKEN = "[***]"                        # Token used to replace masked annotations
+
+# A reference to a masked context of a document, the context string is only built when it is converted to a string
+# The string is remembered by the masker, so the inputs sharing a context build it once
+class LazyContext(Record):
+    __slots__ = ('masker', 'targetSpans', 'window')
+
+    def __init__(self, masker, targetSpans, window=None):
+        self.masker = masker                                    # Masker of the document the context belongs to
+        self.targetSpans = targetSpans                          # Spans of the annotations that are not masked
+        self.window = window                                    # (start, end) range of the document covered by the context, None for the whole document
+
+    def __str__(self):
+        return self.masker.maskedContext(self.targetSpans, self.window)
+
+# A class that masks the annotations of one document in a single pass and remembers the masked contexts it has built
+class ContextMasker:
+    def __init__(self, text, annotations, maskedType):
+        self.text = text                                        # Text of the document
+        self.maskedType = maskedType                            # Type of the annotations that are masked unless they are targets
+        # Spans of the maskable annotations sorted by position, together with their index in the document
+        self.maskableSpans = sorted((ann.start, ann.end, i) for i, ann in enumerate(annotations) if ann.type == maskedType)
+        # Spans and lines of the annotation string, in the order of the annotations in the document
+        self.annotationSpans = [(ann.start, ann.end) for ann in annotations]
+        self.annotationLines = [f"{ann.pmid} {ann.start} {ann.end} {ann.text} {ann.type} {ann.id}\n" for ann in annotations]
+        self.maskedContexts = {}                                # Masked contexts keyed by the set of target spans and the window
+        self.lazyContexts = {}                                  # References to masked contexts keyed by the set of target spans and the window
+
+    # The caches are not pickled, a pickled masker only holds one copy of the document
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['maskedContexts'] = {}
+        state['lazyContexts'] = {}
+        return state
+
+    # Returns the context with every annotation of the masked type replaced by the mask token, except for the targets
+    # If a (start, end) window is given, the context only covers that range of the document
+    def mask(self, *targets, window=None):
+        return self.maskedContext(frozenset((target.start, target.end) for target in targets), window)
+
+    # Returns the masked context of a set of target spans and a window, it is only built the first time it is asked for
+    def maskedContext(self, targetSpans, window=None):
+        key = (targetSpans, window)
+        if key not in self.maskedContexts:
+            self.maskedContexts[key] = self.buildMaskedContext(targetSpans, window)
+        return self.maskedContexts[key]
+
+    # Returns a reference to the masked context that is built when it is needed
+    def lazy(self, *targets, window=None):
+        key = (frozenset((target.start, target.end) for target in targets), window)
+        if key not in self.lazyContexts:
+            self.lazyContexts[key] = LazyContext(self, *key)
+        return self.lazyContexts[key]
+
+    def buildMaskedContext(self, targetSpans, window=None):
+        windowStart, windowEnd = window if window else (0, len(self.text))
+        targetStarts = {start for start, _ in targetSpans}
+        targetEnds = {end for _, end in targetSpans}
+        pieces = []                                             # Pieces of the masked context
+        maskedIndices = set()                                   # Indices of the annotations that are masked
+        cursor = windowStart                                    # Position in the text up to which the pieces are built
+
+        for start, end, i in self.maskableSpans:
+            # Skip the annotations outside of the window
+            if end <= windowStart or start >= windowEnd:
+                continue
+            # Keep the annotations that share their start or end with a target
+            if start in targetStarts or end in targetEnds:
+                continue
+            maskedIndices.add(i)
+            start, end = max(start, windowStart), min(end, windowEnd)
+            # An annotation overlapping the previous mask is covered by that mask
+            if start < cursor:
+                cursor = max(cursor, end)
+                continue
+            pieces.append(self.text[cursor:start])
+            pieces.append(MASK_TOKEN)
+            cursor = end
+        pieces.append(self.text[cursor:windowEnd])
+
+        # Accumulate the annotations within the window that are not masked for inclusion in the context
+        annotationString = "".join(line for i, (line, (start, end)) in enumerate(zip(self.annotationLines, self.annotationSpans))
+                                   if i not in maskedIndices and (window is None or (start < windowEnd and end > windowStart)))
+
+        # Return the masked context concatenated with the annotation string
+        return "".join(pieces) + "\n" + annotationString
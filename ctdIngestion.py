@@ -0,0 +1,154 @@
+import csv
+import gzip
+import html
+import multiprocessing
+import re
+import time
+from collections import deque
+
+# Columns of the chemical-disease associations of CTD, in the order of the TSV and CSV releases
+CTD_COLUMNS = ('ChemicalName', 'ChemicalID', 'CasRN', 'DiseaseName', 'DiseaseID', 'DirectEvidence', 'InferenceGeneSymbol', 'InferenceScore', 'OmimIDs', 'PubMedIDs')
+
+# Columns that are needed to build the triplets, the other columns are not read
+CTD_FIELDS = ('ChemicalID', 'DiseaseID', 'DirectEvidence', 'InferenceScore', 'PubMedIDs')
+FIELD_COLUMNS = [CTD_COLUMNS.index(field) for field in CTD_FIELDS]
+
+# Function to turn the fields of a CTD row into (chemical, disease, relation, pmids), a missing or empty field is None
+# The relation is INF for inferred associations, THR or CID for direct evidence and NIL otherwise, the pmids are ('NIL',) if the row has none
+def rowTriplets(chemical, diseaseId, directEvidence, inferenceScore, pmids):
+    disease = diseaseId.split(':')[1] if diseaseId else 'NIL'
+
+    relation = 'NIL'
+    if directEvidence == "therapeutic":
+        relation = 'THR'
+    elif directEvidence == "marker/mechanism":
+        relation = 'CID'
+    if inferenceScore:
+        relation = 'INF'
+
+    return chemical, disease, relation, tuple(pmids.split('|')) if pmids else ('NIL',)
+
+# Start and end of a row and the needed fields of the CTD XML file, the rows only contain elements with text
+# Empty elements are left out of the matches, a field that is missing or empty is None
+# Every alternative starts with the same < so that the expression engine only tries them at the start of an element
+ROW_PATTERN = re.compile(rb'<(?:(Row)|(/Row)|(' + b'|'.join(field.encode() for field in CTD_FIELDS) + rb')>([^<]+)</\3)>')
+
+# Function to parse a chunk of complete Row elements of the CTD XML file
+# The needed fields are found with one regular expression instead of parsing every element, only the text with entities is unescaped
+def parseXmlChunk(chunk):
+    rows = []
+    fields = {}
+    for rowStart, rowEnd, field, text in ROW_PATTERN.findall(chunk):
+        if rowStart:
+            fields = {}
+        elif rowEnd:
+            rows.append(rowTriplets(*(fields.get(field) for field in CTD_FIELDS)))
+        else:
+            text = text.decode('utf-8')
+            fields[field.decode()] = html.unescape(text) if '&' in text else text
+    return rows
+
+# Function to parse a chunk of lines of the CTD TSV or CSV files, the comment lines start with #
+def parseDelimitedChunk(chunk, delimiter='\t'):
+    lines = [line for line in chunk if line.strip() and not line.startswith('#')]
+    # Only the CSV fields can be quoted, the TSV lines are split directly
+    records = csv.reader(lines) if delimiter == ',' else (line.rstrip('\r\n').split('\t') for line in lines)
+    return [rowTriplets(*(values[column] or None if column < len(values) else None for column in FIELD_COLUMNS)) for values in records]
+
+def parseCsvChunk(chunk):
+    return parseDelimitedChunk(chunk, ',')
+
+# Function to open a CTD file that may be compressed with gzip
+def openCTD(path, mode):
+    encoding = None if 'b' in mode else 'utf-8'
+    return gzip.open(path, mode, encoding=encoding) if path.endswith('.gz') else open(path, mode, encoding=encoding)
+
+# Function to read the CTD XML file in chunks of about chunkBytes bytes that end after a Row element
+def xmlChunks(path, chunkBytes):
+    with openCTD(path, 'rb') as fp:
+        buffer = b''
+        started = False
+        while True:
+            block = fp.read(chunkBytes)
+            buffer += block
+            # Skip the declaration and the root element before the first row
+            if not started:
+                first = buffer.find(b'<Row>')
+                if first < 0:
+                    if not block:
+                        return
+                    continue
+                buffer = buffer[first:]
+                started = True
+            cut = buffer.rfind(b'</Row>')
+            if cut >= 0:
+                cut += len(b'</Row>')
+                yield buffer[:cut]
+                buffer = buffer[cut:]
+            if not block:
+                return
+
+# Function to read the CTD TSV or CSV files in chunks of about chunkBytes bytes of whole lines
+def lineChunks(path, chunkBytes):
+    with openCTD(path, 'rt') as fp:
+        while True:
+            chunk = fp.readlines(chunkBytes)
+            if not chunk:
+                return
+            yield chunk
+
+# Function to apply a function to the chunks in a pool of processes, yielding the results in order
+# At most maxPending chunks are read ahead, so the file is never read into memory as a whole
+def orderedMap(pool, function, chunks, maxPending):
+    pending = deque()
+    for chunk in chunks:
+        pending.append(pool.apply_async(function, (chunk,)))
+        if len(pending) >= maxPending:
+            yield pending.popleft().get()
+    while pending:
+        yield pending.popleft().get()
+
+# A counter that prints the progress at most once every interval seconds
+class ThrottledProgress:
+    def __init__(self, label, interval=5.0):
+        self.label = label                                      # Name of the counted items in the progress lines
+        self.interval = interval                                # Smallest number of seconds between two progress lines
+        self.count = 0                                          # Number of items counted so far
+        self.start = time.time()
+        self.last = self.start
+
+    def update(self, count):
+        self.count += count
+        now = time.time()
+        if now - self.last >= self.interval:
+            self.last = now
+            print(f"{self.label}: {self.count} done ({self.count / (now - self.start):.0f}/s).")
+
+    def close(self):
+        print(f"{self.label}: {self.count} done in {time.time() - self.start:.1f}s.")
+
+# Function to stream the rows of a CTD chemical-disease file as (chemical, disease, relation, pmids) in the order of the file
+# The XML file and the TSV and CSV releases are read, gzipped or not, and with workers > 1 the chunks are parsed in a pool of processes
+def iterCTDRows(path, workers=1, chunkBytes=1 << 24, progress=None):
+    name = path[:-3] if path.endswith('.gz') else path
+    if name.endswith('.xml'):
+        function, chunks = parseXmlChunk, xmlChunks(path, chunkBytes)
+    elif name.endswith('.csv'):
+        function, chunks = parseCsvChunk, lineChunks(path, chunkBytes)
+    elif name.endswith('.tsv'):
+        function, chunks = parseDelimitedChunk, lineChunks(path, chunkBytes)
+    else:
+        raise ValueError(f"unknown CTD file format: {path}, expected .xml, .tsv or .csv, optionally gzipped")
+
+    if workers > 1:
+        with multiprocessing.Pool(workers) as pool:
+            for rows in orderedMap(pool, function, chunks, 2 * workers):
+                if progress is not None:
+                    progress.update(len(rows))
+                yield from rows
+    else:
+        for chunk in chunks:
+            rows = function(chunk)
+            if progress is not None:
+                progress.update(len(rows))
+            yield from rows
@@ -0,0 +1,228 @@
+import argparse
+import json
+import os
+import pickle
+import shutil
+import numpy as np
+
+BUNDLE_FORMAT = "knowledgeGraphBundle"      # Name of the format written in the manifest
+BUNDLE_VERSION = 1                          # Version of the bundle layout
+MANIFEST_FILE = "manifest.json"             # Name of the manifest in the bundle directory
+TRIPLET_SETS = ("all", "train", "validation", "test", "ctd", "cdr")    # Triplet sets of a bundle, stored as (entity1, relation, entity2) rows
+VOCABULARIES = ("entities", "relations")    # String tables of a bundle, the position of a string is its ID
+HASHES = ("ctdRows", "cdrDocuments")        # Sorted hashes of the CTD rows and CDR documents of the last build, to find the new or changed ones
+
+# Text files written by the text export for every triplet set, with the names used by tripleExtraction.py before the bundles
+TEXT_FILES = {
+    "all": "tripletsAll.txt",
+    "train": "tripletsAllTrain.txt",
+    "validation": "tripletsAllValidation.txt",
+    "test": "tripletsAllTest.txt",
+    "ctd": "tripletsCTD.txt",
+    "cdr": "tripletsCDR.txt",
+}
+# Pickled ID maps written by the text export for every vocabulary
+PICKLE_FILES = {"entities": "entityToID.pkl", "relations": "relationToID.pkl"}
+
+# Function to build the path of an array of a bundle
+def bundleArrayPath(directory, arrayName):
+    return os.path.join(directory, f"{arrayName}.npy")
+
+# Function to read the manifest of a bundle
+def readManifest(directory):
+    with open(os.path.join(directory, MANIFEST_FILE)) as inputFile:
+        manifest = json.load(inputFile)
+    if manifest.get("format") != BUNDLE_FORMAT or manifest.get("version") != BUNDLE_VERSION:
+        raise ValueError(f"{directory} is not a knowledge graph bundle of version {BUNDLE_VERSION}")
+    return manifest
+
+# Function to write the manifest of a bundle, the manifest is replaced at once so that a reader never sees a partial bundle
+def writeManifest(directory, manifest):
+    temporaryFile = os.path.join(directory, MANIFEST_FILE + '.tmp')
+    with open(temporaryFile, 'w') as outputFile:
+        json.dump(manifest, outputFile)
+    os.replace(temporaryFile, os.path.join(directory, MANIFEST_FILE))
+
+# Function to turn a {string: ID} map into the strings in the order of their IDs, the IDs must be 0 to len - 1
+def stringsByID(stringToID):
+    strings = [None] * len(stringToID)
+    for string, idx in stringToID.items():
+        strings[idx] = string
+    if any(string is None for string in strings):
+        raise ValueError("the IDs of a vocabulary must be the numbers from 0 to its size - 1")
+    return strings
+
+# Function to write a string table: the UTF-8 bytes of the strings one after another and the offset of every string in the bytes
+def writeStringTable(directory, name, strings):
+    encoded = [string.encode('utf-8') for string in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(string) for string in encoded])
+    np.save(bundleArrayPath(directory, f"{name}-offsets"), offsets)
+    np.save(bundleArrayPath(directory, f"{name}-strings"), np.frombuffer(b''.join(encoded), dtype=np.uint8))
+
+# Function to save a triplet set as int32 rows and return its number of triplets
+def saveTriplets(directory, arrayName, triplets):
+    array = np.asarray(triplets).reshape(-1, 3)
+    if len(array) and array.max() > np.iinfo(np.int32).max:
+        raise ValueError(f"the IDs of {arrayName} do not fit in int32")
+    np.save(bundleArrayPath(directory, arrayName), array.astype(np.int32))
+    return len(array)
+
+# Function to write a bundle from the triplet sets and the {string: ID} maps of the entities and relations
+# hashes holds the sorted row and document hashes of the build, and every update is a dictionary with the entity and relation
+# counts before and after the update and the triplet sets it added
+# The bundle is written to a new directory that replaces the old bundle once it is complete, so a reader never sees a partial bundle
+# and the old arrays stay valid for the readers that mapped them
+def writeBundle(directory, tripletSets, entityToID, relationToID, hashes=None, updates=()):
+    directory = directory.rstrip('/')
+    temporaryDirectory = directory + '.tmp'
+    shutil.rmtree(temporaryDirectory, ignore_errors=True)
+    os.makedirs(temporaryDirectory)
+
+    triplets = {name: saveTriplets(temporaryDirectory, f"triplets-{name}", tripletSets[name]) for name in TRIPLET_SETS}
+
+    vocabularies = {}
+    for name, stringToID in zip(VOCABULARIES, (entityToID, relationToID)):
+        writeStringTable(temporaryDirectory, name, stringsByID(stringToID))
+        vocabularies[name] = len(stringToID)
+
+    hashCounts = {}
+    for name, array in (hashes or {}).items():
+        np.save(bundleArrayPath(temporaryDirectory, f"hashes-{name}"), np.asarray(array, dtype=np.int64))
+        hashCounts[name] = len(array)
+
+    updateEntries = []
+    for number, update in enumerate(updates, 1):
+        updateTriplets = {name: saveTriplets(temporaryDirectory, f"update-{number}-{name}", update["triplets"][name]) for name in TRIPLET_SETS}
+        updateEntries.append(dict(update, triplets=updateTriplets))
+
+    writeManifest(temporaryDirectory, {
+        "format": BUNDLE_FORMAT,
+        "version": BUNDLE_VERSION,
+        "triplets": triplets,
+        "vocabularies": vocabularies,
+        "hashes": hashCounts,
+        "updates": updateEntries,
+    })
+
+    if os.path.exists(directory):
+        oldDirectory = directory + '.old'
+        shutil.rmtree(oldDirectory, ignore_errors=True)
+        os.replace(directory, oldDirectory)
+        os.replace(temporaryDirectory, directory)
+        shutil.rmtree(oldDirectory)
+    else:
+        os.replace(temporaryDirectory, directory)
+
+# The strings of a vocabulary read from a memory-mapped string table, indexed by their IDs
+class StringTable:
+    def __init__(self, offsets, data):
+        self.offsets = offsets                                  # Offset of every string in the bytes, and the end of the last string
+        self.data = data                                        # UTF-8 bytes of the strings one after another
+        self.ids = None                                         # {string: ID} map, built when a string is first looked up
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, idx):
+        if not 0 <= idx < len(self):
+            raise IndexError(idx)
+        return self.data[self.offsets[idx]:self.offsets[idx + 1]].tobytes().decode('utf-8')
+
+    def __iter__(self):
+        for idx in range(len(self)):
+            yield self[idx]
+
+    # Returns the {string: ID} map of the vocabulary
+    def toDict(self):
+        if self.ids is None:
+            self.ids = {string: idx for idx, string in enumerate(self)}
+        return self.ids
+
+    # Returns the ID of a string
+    def index(self, string):
+        return self.toDict()[string]
+
+# Read access to a bundle written by writeBundle, the arrays are memory-mapped on first use and never copied
+class KnowledgeGraphBundle:
+    def __init__(self, directory):
+        self.directory = directory
+        manifest = readManifest(directory)
+        self.counts = manifest["triplets"]                      # Number of triplets of every set
+        self.sizes = manifest["vocabularies"]                   # Number of strings of every vocabulary
+        self.hashCounts = manifest.get("hashes", {})            # Number of hashes of the rows and documents of the last build
+        self.updates = manifest.get("updates", [])              # Entity and relation counts and triplet counts of every update, in order
+        self.arrays = {}                                        # Memory-mapped arrays that are opened
+        self.tables = {}                                        # String tables that are opened
+
+    # The memory maps are not pickled, every process opens its own
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['arrays'] = {}
+        state['tables'] = {}
+        return state
+
+    def array(self, arrayName):
+        if arrayName not in self.arrays:
+            self.arrays[arrayName] = np.load(bundleArrayPath(self.directory, arrayName), mmap_mode='r')
+        return self.arrays[arrayName]
+
+    # Returns the (entity1, relation, entity2) rows of a triplet set as a read-only int32 array
+    def triplets(self, name):
+        if name not in self.counts:
+            raise KeyError(f"unknown triplet set {name}, the sets are {', '.join(self.counts)}")
+        return self.array(f"triplets-{name}")
+
+    # Returns the sorted hashes of the CTD rows or CDR documents of the last build, or None if the bundle has none
+    def hashes(self, name):
+        return self.array(f"hashes-{name}") if name in self.hashCounts else None
+
+    # Returns a triplet set added by an update, the updates are numbered from 1
+    def updateTriplets(self, number, name):
+        if not 1 <= number <= len(self.updates):
+            raise IndexError(number)
+        return self.array(f"update-{number}-{name}")
+
+    # Returns the string table of a vocabulary
+    def vocabulary(self, name):
+        if name not in self.tables:
+            if name not in self.sizes:
+                raise KeyError(f"unknown vocabulary {name}, the vocabularies are {', '.join(self.sizes)}")
+            self.tables[name] = StringTable(self.array(f"{name}-offsets"), self.array(f"{name}-strings"))
+        return self.tables[name]
+
+# Function to read the strings of the entity and relation vocabularies in the order of their IDs
+# They are read from the bundle if it exists, otherwise from the pickled ID maps of the text export, otherwise (None, None) is returned
+def loadVocabularyStrings(directory, pickleDirectory):
+    if os.path.exists(os.path.join(directory, MANIFEST_FILE)):
+        bundle = KnowledgeGraphBundle(directory)
+        return tuple(list(bundle.vocabulary(name)) for name in VOCABULARIES)
+    paths = [os.path.join(pickleDirectory, PICKLE_FILES[name]) for name in VOCABULARIES]
+    if all(os.path.exists(path) for path in paths):
+        maps = []
+        for path in paths:
+            with open(path, 'rb') as f:
+                maps.append(stringsByID(pickle.load(f)))
+        return tuple(maps)
+    return None, None
+
+# Function to export a bundle as the text triplet files and the pickled ID maps that tripleExtraction.py wrote before the bundles
+def exportText(bundle, outputDirectory):
+    os.makedirs(outputDirectory, exist_ok=True)
+    for name, fileName in TEXT_FILES.items():
+        np.savetxt(os.path.join(outputDirectory, fileName), bundle.triplets(name), fmt='%d %d %d')
+        # The triplets added by every update, e.g. tripletsUpdate1All.txt
+        for number in range(1, len(bundle.updates) + 1):
+            np.savetxt(os.path.join(outputDirectory, fileName.replace('triplets', f'tripletsUpdate{number}', 1)), bundle.updateTriplets(number, name), fmt='%d %d %d')
+    for name, fileName in PICKLE_FILES.items():
+        with open(os.path.join(outputDirectory, fileName), 'wb') as f:
+            pickle.dump(bundle.vocabulary(name).toDict(), f)
+
+if __name__ == '__main__':
+    # Export a bundle as text triplets and pickled ID maps
+    parser = argparse.ArgumentParser(description='Export a knowledge graph bundle as text triplet files and pickled ID maps')
+    parser.add_argument('bundle', help='Directory of the bundle')
+    parser.add_argument('--output-dir', default='./Knowledge_Representation', help='Directory of the text and pickle files')
+    args = parser.parse_args()
+
+    exportText(KnowledgeGraphBundle(args.bundle), args.output_dir)
@@ -0,0 +1,121 @@
+import numpy as np
+import torch
+from torch.utils.data import Dataset, Sampler
+
+# A batch sampler that puts inputs of similar length in the same batch, so that a batch is only padded to its longest input
+# The inputs are grouped into buckets of bucketWidth tokens and the batches are taken from one bucket at a time
+class LengthBucketBatchSampler(Sampler):
+    def __init__(self, lengths, batchSize, bucketWidth=32, shuffle=False, seed=0, dropLast=False):
+        self.lengths = np.asarray(lengths)                      # Number of tokens of every input
+        self.batchSize = batchSize                              # Number of inputs in a batch
+        self.bucketWidth = bucketWidth                          # Range of lengths covered by a bucket
+        self.shuffle = shuffle                                  # Whether the inputs of a bucket and the order of the batches are shuffled
+        self.seed = seed                                        # Seed of the shuffling, combined with the epoch
+        self.dropLast = dropLast                                # Whether the incomplete last batch of every bucket is dropped
+        self.epoch = 0                                          # Number of times the sampler has been iterated
+
+    def batches(self, generator=None):
+        indices = np.arange(len(self.lengths))
+        if generator is not None:
+            indices = generator.permutation(indices)
+        # A stable sort keeps the shuffled order within a bucket
+        indices = indices[np.argsort(self.lengths[indices] // self.bucketWidth, kind='stable')]
+        buckets = np.split(indices, np.flatnonzero(np.diff(self.lengths[indices] // self.bucketWidth)) + 1) if len(indices) else []
+
+        batches = []
+        for bucket in buckets:
+            for start in range(0, len(bucket), self.batchSize):
+                batch = bucket[start:start + self.batchSize]
+                if len(batch) == self.batchSize or not self.dropLast:
+                    batches.append(batch.tolist())
+        if generator is not None:
+            batches = [batches[i] for i in generator.permutation(len(batches))]
+        return batches
+
+    def __iter__(self):
+        generator = np.random.default_rng((self.seed, self.epoch)) if self.shuffle else None
+        self.epoch += 1
+        return iter(self.batches(generator))
+
+    def __len__(self):
+        return len(self.batches())
+
+# Function to batch inputs of different lengths, the sequences are padded to the longest sequence of the batch
+def collateDynamic(batch, padTokenId=0):
+    inputIds, attentionMasks, firstIDs, secondIDs, startTokenIndices, endTokenIndices = zip(*batch)
+    width = max(len(ids) for ids in inputIds)
+    paddedIds = torch.full((len(batch), width), padTokenId, dtype=torch.long)
+    paddedMasks = torch.zeros((len(batch), width), dtype=torch.long)
+    for i, (ids, mask) in enumerate(zip(inputIds, attentionMasks)):
+        paddedIds[i, :len(ids)] = ids
+        paddedMasks[i, :len(mask)] = mask
+    return paddedIds, paddedMasks, list(firstIDs), list(secondIDs), torch.stack(startTokenIndices), torch.stack(endTokenIndices)
+
+# Function to pack sequences into bins of at most maxLength tokens with best fit decreasing
+# Returns the indices of the sequences of every bin, the longest sequences are placed first
+def packSequences(lengths, maxLength):
+    lengths = np.asarray(lengths)
+    binsWithSpace = [[] for _ in range(maxLength + 1)]         # Bins keyed by the number of tokens they still have room for
+    bins = []                                                   # Indices of the sequences of every bin
+
+    for i in np.argsort(-lengths, kind='stable'):
+        length = int(lengths[i])
+        if length > maxLength:
+            raise ValueError(f"sequence {i} has {length} tokens, more than {maxLength}")
+        # Use the fullest bin the sequence fits in, or start a new bin
+        space = next((space for space in range(length, maxLength + 1) if binsWithSpace[space]), None)
+        if space is None:
+            binIndex, space = len(bins), maxLength
+            bins.append([])
+        else:
+            binIndex = binsWithSpace[space].pop()
+        bins[binIndex].append(int(i))
+        binsWithSpace[space - length].append(binIndex)
+
+    return bins
+
+# Dataset that packs several inputs of a tokenized store into one sequence of maxLength tokens
+# Each input keeps its own [CLS] and [SEP] tokens, the segment ids tell the inputs of a sequence apart (0 is padding) and
+# the ground truth token indices are shifted to the position of their input in the sequence
+class PackedDataset(Dataset):
+    def __init__(self, shards, maxLength=None):
+        self.shards = shards                                    # TokenizedShards reader of the store
+        self.maxLength = maxLength or shards.maxLength          # Number of tokens of a packed sequence
+        self.packs = packSequences(shards.lengths(), self.maxLength)
+
+    def __len__(self):
+        return len(self.packs)
+
+    def __getitem__(self, idx):
+        inputIds = torch.full((self.maxLength,), self.shards.padTokenId, dtype=torch.long)
+        segmentIds = torch.zeros(self.maxLength, dtype=torch.long)
+        segmentStarts, firstIDs, secondIDs, startTokenIndices, endTokenIndices = [], [], [], [], []
+        position = 0
+        for segment, i in enumerate(self.packs[idx]):
+            ids, length, startTokenIndex, endTokenIndex, firstID, secondID = self.shards[i]
+            inputIds[position:position + length] = torch.from_numpy(ids[:length].astype(np.int64))
+            segmentIds[position:position + length] = segment + 1
+            segmentStarts.append(position)
+            firstIDs.append(firstID)
+            secondIDs.append(secondID)
+            # An index of -1 means the ground truth is not in the input and is kept as it is
+            startTokenIndices.append(startTokenIndex + position if startTokenIndex >= 0 else -1)
+            endTokenIndices.append(endTokenIndex + position if endTokenIndex >= 0 else -1)
+            position += length
+
+        return (
+            inputIds,                                           # Input IDs of the packed inputs
+            (segmentIds > 0).long(),                            # Attention mask
+            segmentIds,                                         # Segment of every token, starting from 1
+            torch.tensor(segmentStarts),                        # Position of the first token of every input
+            firstIDs,                                           # Chemical IDs
+            secondIDs,                                          # Disease IDs or Chemical 2 IDs
+            torch.tensor(startTokenIndices),                    # Ground truth start token indices in the sequence
+            torch.tensor(endTokenIndices)                       # Ground truth end token indices in the sequence
+        )
+
+# Function to batch packed sequences, the per input values are kept as one list or tensor per sequence
+def collatePacked(batch):
+    inputIds, attentionMasks, segmentIds, segmentStarts, firstIDs, secondIDs, startTokenIndices, endTokenIndices = zip(*batch)
+    return (torch.stack(inputIds), torch.stack(attentionMasks), torch.stack(segmentIds), list(segmentStarts),
+            list(firstIDs), list(secondIDs), list(startTokenIndices), list(endTokenIndices))
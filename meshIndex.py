@@ -0,0 +1,179 @@
+import mmap
+import os
+import struct
+import xml.etree.ElementTree as ET
+from collections.abc import Mapping
+import numpy as np
+
+INDEX_MAGIC = b"MESHIDX\0"                  # Magic bytes at the start of an index file
+INDEX_VERSION = 1                           # Version of the index file layout
+# Header: magic, version, number of descriptors, number of tree numbers, width of a DescriptorUI, size of the tree number blob, size and modification time of the source file
+HEADER_FORMAT = "<8sIIIIQQQ"
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+
+# Function to stream the descriptors of a MeSH XML file, yielding (DescriptorUI, [TreeNumber]) for every descriptor
+def iterDescriptors(meshFile):
+    context = ET.iterparse(meshFile, events=('start', 'end'))
+    _, root = next(context)
+    for event, elem in context:
+        if event == 'end' and elem.tag == 'DescriptorRecord':
+            ui = elem.find('DescriptorUI').text
+            treeNumbers = [tn.text for tn in elem.findall('.//TreeNumber')]
+            yield ui, treeNumbers
+            # Free the descriptors that are already processed
+            root.clear()
+
+# Function to round a position up to a multiple of 8 so that every section of the index is aligned
+def align(position):
+    return (position + 7) // 8 * 8
+
+# Function to build the binary index of a MeSH XML file
+# The index holds the sorted DescriptorUIs, the TreeNumbers of every descriptor and the parent of every TreeNumber
+def buildMeshIndex(meshFile, indexFile):
+    descriptors = sorted(iterDescriptors(meshFile))
+
+    uis = np.array([ui.encode('ascii') for ui, _ in descriptors], dtype=bytes)
+    descriptorTreeOffsets = np.zeros(len(descriptors) + 1, dtype=np.int32)
+    treeNumbers = []
+    treeDescriptors = []
+    for i, (_, descriptorTreeNumbers) in enumerate(descriptors):
+        treeNumbers.extend(descriptorTreeNumbers)
+        treeDescriptors.extend([i] * len(descriptorTreeNumbers))
+        descriptorTreeOffsets[i + 1] = len(treeNumbers)
+
+    # The parent of a TreeNumber is the TreeNumber without its last segment
+    treeNumberPositions = {}
+    for i, treeNumber in enumerate(treeNumbers):
+        treeNumberPositions.setdefault(treeNumber, i)
+    treeParents = np.array([treeNumberPositions.get(treeNumber.rpartition('.')[0], -1) for treeNumber in treeNumbers], dtype=np.int32)
+
+    encodedTreeNumbers = [treeNumber.encode('ascii') for treeNumber in treeNumbers]
+    treeOffsets = np.zeros(len(treeNumbers) + 1, dtype=np.int64)
+    treeOffsets[1:] = np.cumsum([len(treeNumber) for treeNumber in encodedTreeNumbers])
+    treeBlob = b"".join(encodedTreeNumbers)
+
+    sourceStat = os.stat(meshFile)
+    header = struct.pack(HEADER_FORMAT, INDEX_MAGIC, INDEX_VERSION, len(descriptors), len(treeNumbers), uis.dtype.itemsize,
+                         len(treeBlob), sourceStat.st_size, sourceStat.st_mtime_ns)
+    sections = [uis.tobytes(), descriptorTreeOffsets.tobytes(), treeOffsets.tobytes(), treeParents.tobytes(),
+                np.array(treeDescriptors, dtype=np.int32).tobytes(), treeBlob]
+
+    # Write to a temporary file first so that a reader never sees a partial index
+    # Every process has its own temporary file, so processes rebuilding the same index do not write to the same file
+    temporaryFile = f"{indexFile}.{os.getpid()}.tmp"
+    with open(temporaryFile, 'wb') as outputFile:
+        outputFile.write(header)
+        for section in sections:
+            outputFile.write(b"\0" * (align(outputFile.tell()) - outputFile.tell()))
+            outputFile.write(section)
+    os.replace(temporaryFile, indexFile)
+
+# A read-only mapping from DescriptorUI to the list of its TreeNumbers, backed by a memory-mapped index file
+class MeshIndex(Mapping):
+    def __init__(self, indexFile):
+        self.indexFile = indexFile
+        with open(indexFile, 'rb') as inputFile:
+            self.buffer = mmap.mmap(inputFile.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, descriptorCount, treeCount, uiWidth, blobSize, self.sourceSize, self.sourceMtime = struct.unpack_from(HEADER_FORMAT, self.buffer)
+        if magic != INDEX_MAGIC or version != INDEX_VERSION:
+            raise ValueError(f"{indexFile} is not a MeSH index of version {INDEX_VERSION}")
+
+        # Views of the sections, no data is copied
+        position = HEADER_SIZE
+        sections = []
+        for dtype, count in ((f"S{uiWidth}", descriptorCount), (np.int32, descriptorCount + 1), (np.int64, treeCount + 1),
+                             (np.int32, treeCount), (np.int32, treeCount), (np.uint8, blobSize)):
+            position = align(position)
+            sections.append(np.frombuffer(self.buffer, dtype=dtype, count=count, offset=position))
+            position += sections[-1].nbytes
+        self.uis, self.descriptorTreeOffsets, self.treeOffsets, self.treeParents, self.treeDescriptors, self.treeBlob = sections
+
+    # Reopen the index file when the mapping is sent to another process
+    def __reduce__(self):
+        return (MeshIndex, (self.indexFile,))
+
+    # Returns the position of the descriptor in the index, or -1 if it is not in the index
+    def descriptorPosition(self, ui):
+        encoded = ui.encode('ascii')
+        i = int(np.searchsorted(self.uis, encoded))
+        if i < len(self.uis) and self.uis[i] == encoded:
+            return i
+        return -1
+
+    # Returns the TreeNumber at the given position
+    def treeNumber(self, i):
+        return self.treeBlob[self.treeOffsets[i]:self.treeOffsets[i + 1]].tobytes().decode('ascii')
+
+    # Returns the positions of the TreeNumbers of the descriptor
+    def treeNumberPositions(self, ui):
+        i = self.descriptorPosition(ui)
+        if i < 0:
+            raise KeyError(ui)
+        return range(self.descriptorTreeOffsets[i], self.descriptorTreeOffsets[i + 1])
+
+    def __getitem__(self, ui):
+        return [self.treeNumber(i) for i in self.treeNumberPositions(ui)]
+
+    def __contains__(self, ui):
+        return isinstance(ui, str) and self.descriptorPosition(ui) >= 0
+
+    def __iter__(self):
+        return (ui.decode('ascii') for ui in self.uis)
+
+    def __len__(self):
+        return len(self.uis)
+
+# A node of the TreeNumber prefix tree
+class TreeNumberNode:
+    __slots__ = ('children', 'descendantOwners')
+
+    def __init__(self):
+        self.children = {}                                      # Child nodes keyed by the next TreeNumber segment
+        self.descendantOwners = set()                           # Descriptors with a TreeNumber strictly below this node
+
+# A prefix tree over the segments of TreeNumbers, used to find the descriptors that have a more specific descriptor in a set
+class TreeNumberTrie:
+    def __init__(self):
+        self.root = TreeNumberNode()
+
+    # Adds a TreeNumber of the given descriptor, the descriptor is recorded in every proper ancestor node
+    def insert(self, treeNumber, owner):
+        node = self.root
+        for segment in treeNumber.split('.'):
+            node.descendantOwners.add(owner)
+            node = node.children.setdefault(segment, TreeNumberNode())
+
+    # Returns True if a descriptor other than owner has a TreeNumber strictly below the given TreeNumber
+    def hasOtherDescendant(self, treeNumber, owner):
+        node = self.root
+        for segment in treeNumber.split('.'):
+            node = node.children.get(segment)
+            if node is None:
+                return False
+        return bool(node.descendantOwners - {owner})
+
+# Function to find the descriptors of a set that are ancestors of another descriptor of the set in the MeSH hierarchy
+def findAncestorDescriptors(uis, descriptorMap):
+    uis = [ui for ui in uis if ui in descriptorMap]
+    trie = TreeNumberTrie()
+    for ui in uis:
+        for treeNumber in descriptorMap[ui]:
+            trie.insert(treeNumber, ui)
+    return {ui for ui in uis if any(trie.hasOtherDescendant(treeNumber, ui) for treeNumber in descriptorMap[ui])}
+
+# Function to open the index of a MeSH XML file, the index is built next to the XML file if it is missing or older than the XML file
+def loadMeshIndex(meshFile, indexFile=None):
+    indexFile = indexFile or os.path.splitext(meshFile)[0] + '.idx'
+    sourceStat = os.stat(meshFile)
+
+    if os.path.exists(indexFile):
+        try:
+            meshIndex = MeshIndex(indexFile)
+            if (meshIndex.sourceSize, meshIndex.sourceMtime) == (sourceStat.st_size, sourceStat.st_mtime_ns):
+                return meshIndex
+        except ValueError:
+            pass
+
+    buildMeshIndex(meshFile, indexFile)
+    return MeshIndex(indexFile)
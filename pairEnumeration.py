@@ -0,0 +1,62 @@
+# Function to group the annotations of every sentence by their type
+def bucketAnnotationsByType(sentences):
+    buckets = []
+    for sen in sentences:
+        bucket = {}
+        for ann in sen.annotations:
+            bucket.setdefault(ann.type, []).append(ann)
+        buckets.append(bucket)
+    return buckets
+
+# Function to enumerate the mention pairs of a document, yielding (head, tail, pairType, related) for every pair
+def enumerateMentionPairs(sentences, relations, typePairs, window=3):
+    relations = set(relations)                                  # Known (head id, tail id) relations of the document
+    buckets = bucketAnnotationsByType(sentences)
+
+    # Generate intra-sentential pairs
+    for bucket in buckets:
+        for headType, tailType in typePairs:
+            for head in bucket.get(headType, ()):
+                for tail in bucket.get(tailType, ()):
+                    if head.id != tail.id:
+                        yield head, tail, "intra", (head.id, tail.id) in relations
+
+    # Generate inter-sentential pairs between each sentence and the sentences following it within the window
+    for i, bucket in enumerate(buckets):
+        for nextBucket in buckets[i + 1:i + 1 + window]:
+            for headType, tailType in typePairs:
+                # Heads in the current sentence and tails in the next
+                for head in bucket.get(headType, ()):
+                    for tail in nextBucket.get(tailType, ()):
+                        if head.id != tail.id:
+                            yield head, tail, "inter", (head.id, tail.id) in relations
+
+                # Tails in the current sentence and heads in the next, pairs of the same type are already covered above
+                if headType == tailType:
+                    continue
+                for tail in bucket.get(tailType, ()):
+                    for head in nextBucket.get(headType, ()):
+                        if head.id != tail.id:
+                            yield head, tail, "inter", (head.id, tail.id) in relations
+
+# Function to collapse the mention pairs into one group per (head id, tail id), yielding (head, tail, pairType, related, mentions)
+# The first mention pair of a group represents it, intra-sentential pairs come first so a group is intra-sentential if any of its mentions is
+def aggregateMentionPairs(mentionPairs):
+    groups = {}
+    for head, tail, pairType, related in mentionPairs:
+        key = (head.id, tail.id)
+        if key not in groups:
+            groups[key] = (head, tail, pairType, related, [])
+        groups[key][4].append((head, tail))
+    return groups.values()
+
+# Function to enumerate the candidate pairs of a document, yielding (head, tail, pairType, related, mentions) for every candidate
+# typePairs lists the (head type, tail type) combinations and window is the number of following sentences an inter-sentential pair can span
+# With aggregate, there is one candidate per (head id, tail id) and mentions lists its (head, tail) mention pairs, otherwise mentions is None
+def enumeratePairs(sentences, relations, typePairs, window=3, aggregate=False):
+    mentionPairs = enumerateMentionPairs(sentences, relations, typePairs, window)
+    if aggregate:
+        yield from aggregateMentionPairs(mentionPairs)
+    else:
+        for head, tail, pairType, related in mentionPairs:
+            yield head, tail, pairType, related, None
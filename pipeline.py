@@ -0,0 +1,371 @@
+import argparse
+import heapq
+import json
+import multiprocessing
+import os
+import pickle
+from transformers import BertTokenizerFast
+import preprocessCDR1
+import preprocessCDR2
+import preprocessCDR3
+import preprocessCDR4
+import preprocessCHR1
+import preprocessCHR2
+import preprocessCHR3
+from meshIndex import loadMeshIndex
+from pubtatorReader import PubTatorIndex, iterDocuments
+from sentenceCache import SentenceCache
+from sentenceSegmentation import DEFAULT_SEGMENTER, SEGMENTERS, loadSegmenter
+from stageCache import StageCache, cachedStage, documentKey, fileDigest
+from tokenizedStore import mergeStores
+
+# Input file of every split of the corpora and the prefix of their output directories
+CORPORA = {
+    'cdr': {
+        'name': 'CDR',
+        'splits': {
+            'train': './CDR_Data/CDR.Corpus.v010516/CDR_TrainingSet.PubTator.txt',
+            'dev': './CDR_Data/CDR.Corpus.v010516/CDR_DevelopmentSet.PubTator.txt',
+            'test': './CDR_Data/CDR.Corpus.v010516/CDR_TestSet.PubTator.txt',
+        },
+    },
+    'chr': {
+        'name': 'CHR',
+        'splits': {
+            'train': './CHR_Data/CHR_corpus/train.pubtator',
+            'dev': './CHR_Data/CHR_corpus/dev.pubtator',
+            'test': './CHR_Data/CHR_corpus/test.pubtator',
+        },
+    },
+}
+
+# Suffix of the output directory of every split, as in Preprocessed/CDRTest
+SPLIT_NAMES = {'train': 'Training', 'dev': 'Development', 'test': 'Test'}
+
+# Options that select which shards run where, they may differ between the runs of the shards
+SHARD_CONTROL_OPTIONS = ('shard_index', 'workers', 'merge', 'cache_dir', 'sentence_cache', 'no_sentence_cache')
+
+# Name of the manifest written by every shard and by the merge
+SHARD_MANIFEST = 'manifest.json'
+
+# Stages whose output can be checkpointed, in order, the CHR corpus has no hypernym filtering stage
+STAGES = ('pairs1', 'pairs2', 'input')
+
+# Function to build the path of the checkpoint of a stage
+def checkpointPath(outputDir, stage):
+    return os.path.join(outputDir, f"{stage}.stream.pkl")
+
+# Function to write the documents of a stream to a checkpoint while passing them on
+# The checkpoint holds one pickle per document so that it can be written and read without holding the whole corpus
+# The stream holds (key, items) for every document, only the items are written
+def writeCheckpoint(stream, path):
+    with open(path, 'wb') as outputFile:
+        for key, itemsInDoc in stream:
+            pickle.dump(itemsInDoc, outputFile)
+            yield key, itemsInDoc
+
+# Function to stream the documents of a checkpoint
+def readCheckpoint(path):
+    with open(path, 'rb') as inputFile:
+        while True:
+            try:
+                yield pickle.load(inputFile)
+            except EOFError:
+                return
+
+# Function to find the input file of a run
+def inputPath(args):
+    return args.input or CORPORA[args.corpus]['splits'][args.split]
+
+# Function to find the output directory of a run
+def outputPath(args):
+    return args.output_dir or os.path.join('./Preprocessed', CORPORA[args.corpus]['name'] + SPLIT_NAMES[args.split])
+
+# Function to build the (name, function) stages of a corpus that turn the stream of documents into a stream of inputs
+# A loaded segmenter can be passed, otherwise it is loaded by the first stage
+def buildStages(corpus, args, segmenter=None, sentenceCache=None):
+    if corpus == 'cdr':
+        return [
+            ('pairs1', lambda docs: preprocessCDR1.iterInstances(docs, args.batch_size, args.n_process, args.lazy_contexts, args.window,
+                                                                 aggregate=args.aggregate, contextMargin=args.context_margin, segmenter=segmenter, sentenceCache=sentenceCache)),
+            ('pairs2', lambda pairs: preprocessCDR2.iterHypernymFiltering(pairs, loadMeshIndex(args.mesh), args.filter_processes)),
+            ('input', preprocessCDR3.iterQueryConstruction),
+        ]
+    return [
+        ('pairs1', lambda docs: preprocessCHR1.iterInstances(docs, args.batch_size, args.n_process, args.lazy_contexts, args.window,
+                                                             aggregate=args.aggregate, contextMargin=args.context_margin, segmenter=segmenter, sentenceCache=sentenceCache)),
+        ('input', preprocessCHR2.iterQueryConstruction),
+    ]
+
+# Function to count the documents and the items of a stream of (key, items) documents, yielding the items of every document
+# The number of items of every document is also kept, the merge of the shards uses it to find the documents in the outputs
+def countDocuments(stream, counts):
+    for _, itemsInDoc in stream:
+        counts['documents'] += 1
+        counts['items'] += len(itemsInDoc)
+        counts['documentItems'].append(len(itemsInDoc))
+        yield itemsInDoc
+
+# Function to select the parameters and resources that the output of a stage depends on, besides its input
+def stageParams(name, args, segmenter):
+    if name == 'pairs1':
+        return {'corpus': args.corpus, 'window': args.window, 'aggregate': args.aggregate, 'contextMargin': args.context_margin,
+                'lazyContexts': args.lazy_contexts, 'segmenter': segmenter.version}
+    if name == 'pairs2':
+        return {'mesh': fileDigest(args.mesh)}
+    return {'corpus': args.corpus}
+
+# Function to run the stages of a corpus on a split, every stage consumes the documents of the previous stage one at a time
+# The documents of the input file are read unless a stream of documents is given, a loaded segmenter and tokenizer can be passed
+# With args.cache_dir the outputs of the stages are cached for every document and only the documents that changed are processed again
+# Returns the number of documents and of items (pairs or inputs) produced by the last stage, and the number of items of every document
+def runPipeline(args, outputDir, docs=None, segmenter=None, tokenizer=None):
+    os.makedirs(outputDir, exist_ok=True)
+    cache = StageCache(args.cache_dir) if args.cache_dir else None
+    # The segmenter is loaded once here, it is also part of the keys of the cache
+    if segmenter is None and args.start_from is None:
+        segmenter = loadSegmenter(args.segmenter)
+    sentenceCache = None if args.no_sentence_cache else SentenceCache(args.sentence_cache)
+    stages = buildStages(args.corpus, args, segmenter, sentenceCache)
+    stageNames = [name for name, _ in stages]
+    for stage in args.checkpoint + [args.start_from, args.stop_after]:
+        if stage is not None and stage not in stageNames:
+            raise ValueError(f"the {args.corpus} pipeline has no {stage} stage, its stages are {', '.join(stageNames)}")
+    if args.start_from and args.stop_after and stageNames.index(args.stop_after) <= stageNames.index(args.start_from):
+        raise ValueError(f"the {args.stop_after} stage comes before the {args.start_from} stage")
+
+    # Start from the documents of the input file, or from the checkpoint of a stage that was run before
+    # Every document is passed on with its key in the cache, the documents of a checkpoint have no key and are not cached
+    if args.start_from:
+        stream = ((None, itemsInDoc) for itemsInDoc in readCheckpoint(checkpointPath(outputDir, args.start_from)))
+        stages = stages[stageNames.index(args.start_from) + 1:]
+    else:
+        docs = docs if docs is not None else iterDocuments(inputPath(args))
+        stream = ((documentKey(doc) if cache is not None else None, doc) for doc in docs)
+
+    counts = {'documents': 0, 'items': 0, 'documentItems': []}
+    for name, stage in stages:
+        stream = cachedStage(stream, stage, cache, name, stageParams(name, args, segmenter) if cache is not None else None)
+        # The last stage that is run is always written, otherwise its output would be lost
+        if name in args.checkpoint or name == args.stop_after:
+            stream = writeCheckpoint(stream, checkpointPath(outputDir, name))
+        if name == args.stop_after:
+            for i, _ in enumerate(countDocuments(stream, counts)):
+                print("Document #" + str(i) + " done.")
+            if cache is not None:
+                print(cache.summary())
+            return counts
+    stream = countDocuments(stream, counts)
+
+    tokenizer = tokenizer or BertTokenizerFast.from_pretrained(args.tokenizer)
+    tokenization = preprocessCDR4 if args.corpus == 'cdr' else preprocessCHR3
+    if args.format == 'shards':
+        tokenization.tokenize_inputs_and_save_shards(stream, tokenizer, os.path.join(outputDir, 'tokenizedInputs'), args.tokenizer_batch_size,
+                                                     args.shard_size, args.dynamic_length, args.context_cache_tokens)
+    else:
+        # Clear the output file first to avoid appending to an old file
+        tokenizedPath = os.path.join(outputDir, 'tokenizedInputs.pkl')
+        with open(tokenizedPath, 'wb') as outputFile:
+            pass
+        tokenization.tokenize_inputs_and_save(stream, tokenizer, tokenizedPath, tokenization_batch_size=args.tokenizer_batch_size,
+                                              dynamic_length=args.dynamic_length, context_cache_tokens=args.context_cache_tokens)
+    if cache is not None:
+        print(cache.summary())
+    return counts
+
+# Function to order PubMed IDs as numbers, IDs that are not numbers come after them
+def pmidKey(pmid):
+    return (0, len(pmid), pmid) if pmid.isdigit() else (1, 0, pmid)
+
+# Function to split the documents of a PubTator file into numShards ranges of PubMed IDs with about the same number of documents
+# Returns the (first, last) PubMed ID of every shard, or None for a shard without documents
+# The plan only depends on the file, so every machine running shards of the same file finds the same ranges
+def planShards(path, numShards):
+    pmids = sorted(set(PubTatorIndex(path).pmids), key=pmidKey)
+    bounds = [len(pmids) * i // numShards for i in range(numShards + 1)]
+    return [(pmids[bounds[i]], pmids[bounds[i + 1] - 1]) if bounds[i] < bounds[i + 1] else None for i in range(numShards)]
+
+# Function to build the output directory of a shard
+def shardDirectory(outputDir, index, numShards):
+    return os.path.join(outputDir, 'shards', f"shard-{index:05d}-of-{numShards:05d}")
+
+# Function to select the options that must be the same for every shard of a run
+def shardOptions(args):
+    return {key: value for key, value in sorted(vars(args).items()) if key not in SHARD_CONTROL_OPTIONS}
+
+# Function to write a JSON file, the file is replaced at once so that a reader never sees a partial file
+def writeJson(path, content):
+    with open(path + '.tmp', 'w') as outputFile:
+        json.dump(content, outputFile, indent=1)
+    os.replace(path + '.tmp', path)
+
+# Function to run the stages on the documents of one shard and write the manifest of the shard
+# The manifest is written last, so a shard without a manifest has not finished
+def runShard(args, index, plan, segmenter=None, tokenizer=None):
+    directory = shardDirectory(outputPath(args), index, args.num_shards)
+    pmidRange = plan[index]
+    # Only the documents of the shard are read and parsed, from their byte ranges in the file and in the order of the file
+    documentIndex = PubTatorIndex(inputPath(args))
+    positions = [i for i, pmid in enumerate(documentIndex.pmids) if pmidRange and pmidKey(pmidRange[0]) <= pmidKey(pmid) <= pmidKey(pmidRange[1])]
+    # The documents with an empty text are skipped, so only the positions of the documents that are read are recorded
+    readPositions = []
+    def shardDocuments():
+        for position, doc in documentIndex.documentsAt(positions):
+            readPositions.append(position)
+            yield doc
+    counts = runPipeline(args, directory, shardDocuments(), segmenter, tokenizer)
+    documentIndex.close()
+    writeJson(os.path.join(directory, SHARD_MANIFEST), {
+        "shard": index,
+        "numShards": args.num_shards,
+        "firstPmid": pmidRange[0] if pmidRange else None,
+        "lastPmid": pmidRange[1] if pmidRange else None,
+        "documents": counts['documents'],
+        "items": counts['items'],
+        # Position in the file and number of items of every document of the shard, the merge puts the documents back in the order of the file
+        "positions": readPositions,
+        "documentItems": counts['documentItems'],
+        "input": inputPath(args),
+        "options": shardOptions(args),
+        "outputs": sorted(name for name in os.listdir(directory) if name != SHARD_MANIFEST),
+    })
+    return index
+
+workerModels = None                         # Segmenter and tokenizer of a worker process
+
+# Function to load the models of a worker process once for all the shards it runs
+def initShardWorker(args):
+    global workerModels
+    workerModels = (loadSegmenter(args.segmenter), BertTokenizerFast.from_pretrained(args.tokenizer))
+
+# Function to run a shard in a worker process
+def runShardInWorker(task):
+    args, index, plan = task
+    return runShard(args, index, plan, *workerModels)
+
+# Function to run the selected shards of a run, in a pool of worker processes if args.workers > 1
+def runShards(args):
+    if args.workers > 1 and (args.n_process > 1 or args.filter_processes > 1):
+        raise ValueError("the worker processes cannot start processes of their own, use --n-process 1 and --filter-processes 1 with --workers")
+    plan = planShards(inputPath(args), args.num_shards)
+    indices = args.shard_index if args.shard_index else range(args.num_shards)
+
+    if args.workers > 1:
+        with multiprocessing.Pool(args.workers, initializer=initShardWorker, initargs=(args,)) as pool:
+            for index in pool.imap_unordered(runShardInWorker, [(args, index, plan) for index in indices]):
+                print("Shard #" + str(index) + " done.")
+    else:
+        segmenter, tokenizer = loadSegmenter(args.segmenter), BertTokenizerFast.from_pretrained(args.tokenizer)
+        for index in indices:
+            runShard(args, index, plan, segmenter, tokenizer)
+            print("Shard #" + str(index) + " done.")
+
+# Function to read the documents of a pickle stream of a shard as the bytes of their pickles, in the order of the shard
+# A checkpoint holds one pickle per document, the tokenized inputs hold the batches of inputs of every document
+def documentPickles(path, documentItems, checkpoint):
+    with open(path, 'rb') as inputFile:
+        for items in documentItems:
+            start = inputFile.tell()
+            if checkpoint:
+                pickle.load(inputFile)
+            else:
+                while items > 0:
+                    # The third element of a batch holds the chemical ID of every input
+                    items -= len(pickle.load(inputFile)[2])
+            end = inputFile.tell()
+            inputFile.seek(start)
+            yield inputFile.read(end - start)
+
+# Function to combine the outputs of every shard of a run into the output directory
+# The shards hold ranges of PubMed IDs, their documents are put back in the order of the input file so that the merged outputs match a run without shards
+def mergeShards(args):
+    outputDir = outputPath(args)
+    directories = [shardDirectory(outputDir, index, args.num_shards) for index in range(args.num_shards)]
+    missing = [str(index) for index, directory in enumerate(directories) if not os.path.exists(os.path.join(directory, SHARD_MANIFEST))]
+    if missing:
+        raise ValueError(f"shards {', '.join(missing)} of {args.num_shards} have not finished")
+
+    manifests = []
+    for directory in directories:
+        with open(os.path.join(directory, SHARD_MANIFEST)) as inputFile:
+            manifests.append(json.load(inputFile))
+    for manifest in manifests[1:]:
+        for key in ('input', 'options', 'outputs'):
+            if manifest[key] != manifests[0][key]:
+                raise ValueError(f"shard {manifest['shard']} was run with a different {key} than shard 0")
+
+    for manifest in manifests:
+        if len(manifest['positions']) != manifest['documents']:
+            raise ValueError(f"shard {manifest['shard']} has {manifest['documents']} documents in its outputs but {len(manifest['positions'])} in the file")
+
+    # (store, document) of every document of the shards in the order of the file
+    order = [(shard, document) for _, shard, document in sorted((position, shard, document) for shard, manifest in enumerate(manifests)
+                                                                for document, position in enumerate(manifest['positions']))]
+    for name in manifests[0]['outputs']:
+        if name == 'tokenizedInputs':
+            mergeStores([os.path.join(directory, name) for directory in directories], os.path.join(outputDir, name), order, args.shard_size)
+        else:
+            # The documents of the pickle streams of the shards are interleaved by their positions in the file
+            streams = [zip(manifest['positions'], documentPickles(os.path.join(directory, name), manifest['documentItems'], name.endswith('.stream.pkl')))
+                       for directory, manifest in zip(directories, manifests)]
+            with open(os.path.join(outputDir, name), 'wb') as outputFile:
+                for _, data in heapq.merge(*streams, key=lambda document: document[0]):
+                    outputFile.write(data)
+
+    writeJson(os.path.join(outputDir, SHARD_MANIFEST), {
+        "numShards": args.num_shards,
+        "documents": sum(manifest['documents'] for manifest in manifests),
+        "items": sum(manifest['items'] for manifest in manifests),
+        "shards": manifests,
+    })
+
+# Function to build the parser of the options of the pipeline
+def buildParser():
+    parser = argparse.ArgumentParser(description='Run the preprocessing stages of a corpus from the PubTator file to the tokenized inputs without intermediate files')
+    parser.add_argument('--corpus', choices=sorted(CORPORA), default='cdr', help='Corpus to preprocess')
+    parser.add_argument('--split', choices=sorted(SPLIT_NAMES), default='test', help='Split of the corpus to preprocess')
+    parser.add_argument('--input', default=None, help='PubTator file to read instead of the file of the split')
+    parser.add_argument('--output-dir', default=None, help='Directory of the outputs, Preprocessed/<corpus><split> by default')
+    parser.add_argument('--checkpoint', nargs='*', default=[], choices=STAGES, help='Stages whose output is written to <stage>.stream.pkl in the output directory')
+    parser.add_argument('--start-from', choices=STAGES, default=None, help='Read the checkpoint of this stage instead of running the stages up to it')
+    parser.add_argument('--stop-after', choices=STAGES, default=None, help='Stop after this stage and write its checkpoint')
+    parser.add_argument('--cache-dir', default=None, help='Directory caching the output of every stage for every document, only changed documents are processed again')
+    # Options of the pair construction
+    parser.add_argument('--batch-size', type=int, default=32, help='Number of documents sent to SpaCy at once')
+    parser.add_argument('--n-process', type=int, default=1, help='Number of processes used by SpaCy for sentence segmentation')
+    parser.add_argument('--lazy-contexts', action='store_true', help='Store references to the masked contexts that are built when they are needed')
+    parser.add_argument('--window', type=int, default=3, help='Number of following sentences that inter-sentential pairs can span')
+    parser.add_argument('--aggregate', action='store_true', help='Collapse the mention pairs into one pair per pair of entity ids')
+    parser.add_argument('--context-margin', type=int, default=None, help='Only keep the sentences covering the pair and this many sentences around them in the context')
+    parser.add_argument('--segmenter', choices=list(SEGMENTERS), default=DEFAULT_SEGMENTER, help='Backend used to split the documents into sentences')
+    parser.add_argument('--sentence-cache', default='./Preprocessed/sentenceCache.sqlite', help='SQLite file caching the sentence offsets of the documents')
+    parser.add_argument('--no-sentence-cache', action='store_true', help='Segment every document with SpaCy without reading or writing the cache')
+    # Options of the hypernym filtering
+    parser.add_argument('--mesh', default='./MeSH/desc2024.xml', help='MeSH descriptor file used for the hypernym filtering')
+    parser.add_argument('--filter-processes', type=int, default=1, help='Number of processes used to filter the documents')
+    # Options of the tokenization
+    parser.add_argument('--tokenizer', default='dmis-lab/biobert-base-cased-v1.2', help='Name or path of the tokenizer')
+    parser.add_argument('--tokenizer-batch-size', type=int, default=1024, help='Number of inputs sent to the tokenizer at once, across documents')
+    parser.add_argument('--context-cache-tokens', type=int, default=2000000, help='Maximum number of context tokens kept to tokenize identical contexts once, 0 disables the cache')
+    parser.add_argument('--format', choices=['pickle', 'shards'], default='pickle', help='Write a stream of pickled batches or a directory of memory-mapped shards')
+    parser.add_argument('--shard-size', type=int, default=65536, help='Number of inputs per shard in the shards format')
+    parser.add_argument('--dynamic-length', action='store_true', help='Pad every batch to its longest input, or store the shards without padding')
+    # Options of the sharded execution
+    parser.add_argument('--num-shards', type=int, default=None, help='Split the documents into this many ranges of PubMed IDs that are run separately')
+    parser.add_argument('--shard-index', type=int, nargs='*', default=[], help='Shards to run on this machine, every shard by default')
+    parser.add_argument('--workers', type=int, default=1, help='Number of worker processes running the shards, each loading the models once')
+    parser.add_argument('--merge', action='store_true', help='Combine the outputs of the finished shards into the output directory instead of running shards')
+    return parser
+
+if __name__ == '__main__':
+    parser = buildParser()
+    args = parser.parse_args()
+    if args.merge and args.num_shards is None:
+        parser.error("--merge needs the --num-shards of the run whose shards are combined")
+
+    if args.num_shards is None:
+        runPipeline(args, outputPath(args))
+    elif args.merge:
+        mergeShards(args)
+    else:
+        runShards(args)
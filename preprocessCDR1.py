@@ -1,11 +1,18 @@
-from bioc import pubtator
-import spacy
+from pubtatorReader import iterDocuments
+import argparse
 import pickle
-import copy
 import os
+from annotationPlacement import placeAnnotations
+from contextMasking import ContextMasker
+from pairEnumeration import enumeratePairs
+from records import Record, compactAnnotations
+from sentenceCache import SentenceCache
+from sentenceSegmentation import DEFAULT_SEGMENTER, SEGMENTERS, loadSegmenter, segmentDocuments
 
 # A class to represent sentences within the document
-class Sentence:
+class Sentence(Record):
+    __slots__ = ('text', 'start', 'end', 'annotations')
+
     def __init__(self, text, start, end, annotations=None):
         self.text = text                                        # Text content of the sentence
         self.start = start                                      # Starting index of the sentence within the document
@@ -16,148 +23,113 @@ class Sentence:
         self.annotations.append(annotation)
 
 # A class for chemical-disease pairs with context and metadata
-class Pair:
-    def __init__(self, chemical, disease, context, pmid, pairType, groundTruthStart, groundTruthEnd):
+class Pair(Record):
+    __slots__ = ('chemical', 'disease', 'context', 'pmid', 'pairType', 'groundTruthStart', 'groundTruthEnd', 'mentions', 'contextOffset')
+
+    def __init__(self, chemical, disease, context, pmid, pairType, groundTruthStart, groundTruthEnd, mentions=None, contextOffset=0):
         self.chemical = chemical                                # Chemical
         self.disease = disease                                  # Disease
-        self.context = context                                  # Context in which the pair occurs, with masking applied
+        self.context = context                                  # Context in which the pair occurs with masking applied, either a string or a LazyContext
         self.pmid = pmid                                        # PubMed ID of the article
         self.pairType = pairType                                # Specifies whether the pair is intra-sentential or inter-sentential
         self.groundTruthStart = groundTruthStart                # Starting position of the disease that we want to predict, it serves as the label of the datapoint
         self.groundTruthEnd = groundTruthEnd                    # Ending position of the disease that we want to predict, it serves as the label of the datapoint
+        self.mentions = mentions                                # Spans (headStart, headEnd, tailStart, tailEnd) of the mention pairs collapsed into this pair, None if it is a single mention pair
+        self.contextOffset = contextOffset                      # Position of the context within the document, the ground truth positions are relative to the context
 
     # Representation of a Pair object when printed
     def __repr__(self):
-        return f"Pair(chemical={self.chemical.text}, disease={self.disease.text}, context=[{self.context[:30]}...], pmid={self.pmid}, pair_type={self.pairType})"
+        return f"Pair(chemical={self.chemical.text}, disease={self.disease.text}, context=[{str(self.context)[:30]}...], pmid={self.pmid}, pair_type={self.pairType})"
 
 # Function to mask all diseases in the context except for the target disease
 def maskOtherDiseasesInContext(context, targetDiseaseAnnotation, allAnnotations):
-    MASK_TOKEN = "[***]"                    # Token used to replace masked diseases
-    maskedContext = context                 # Copy of the context to apply masking to
-    annotationString = ""                   # String to store formatted annotations
-
-    # Keep track of adjustments in indexing due to masking
-    offset = 0
-    for ann in allAnnotations:
-        # Apply masking to diseases that are not the target
-        if ann.type == 'Disease' and ann.start != targetDiseaseAnnotation.start and ann.end != targetDiseaseAnnotation.end:
-            maskedContext = maskedContext[:ann.start - offset] + MASK_TOKEN + maskedContext[ann.end - offset:]
-            offset += len(ann.text) - len(MASK_TOKEN)
-        else:
-            # Accumulate annotations for inclusion in the context
-            annotationString += f"{ann.pmid} {ann.start} {ann.end} {ann.text} {ann.type} {ann.id}\n"
-
-    # Return the masked context concatenated with the annotation string
-    return maskedContext + "\n" + annotationString
+    return ContextMasker(context, allAnnotations, 'Disease').mask(targetDiseaseAnnotation)
 
-# Function to create chemical-disease pairs from a list of documents
-def instanceConstruction(docs):
-    pairs = []                              # List to store all the pairs
-    nlp = spacy.load("en_core_sci_scibert") # Load a SpaCy model specialized in biomedical text
+# Entity types of the (head, tail) pairs that are generated
+TYPE_PAIRS = [('Chemical', 'Disease')]
+
+# Function to create chemical-disease pairs from a stream of documents, yielding the list of pairs of every document in order
+# A loaded segmenter can be passed, otherwise the default segmenter is loaded here
+# If a SentenceCache is given, the sentence offsets of the documents that were segmented before are read from it instead of SpaCy
+def iterInstances(docs, batchSize=32, nProcess=1, lazyContexts=False, window=3, typePairs=TYPE_PAIRS, aggregate=False, contextMargin=None, segmenter=None, sentenceCache=None):
+    if segmenter is None:
+        segmenter = loadSegmenter()         # Load a SpaCy model specialized in biomedical text with only the sentence boundary components
 
-    for doc in docs:
+    # Stream the documents through the segmenter in batches to split them into sentences
+    for doc, sentenceSpans in segmentDocuments(docs, segmenter, batchSize, nProcess, sentenceCache):
         pairsInDoc = []                     # Pairs in specific doc
-        relationsInDoc = []                 # Relations in specific doc
-        annotations = doc.annotations       # Extract annotations from the document
+        relationsInDoc = set()              # Relations in specific doc
+        annotations = compactAnnotations(doc.annotations)  # Extract annotations from the document as compact records
         text = doc.text                     # Document text
         pmid = doc.pmid                     # PubMed ID of the document
+        masker = ContextMasker(text, annotations, 'Disease')   # Masks the other diseases, once for every distinct target
+        maskContext = masker.lazy if lazyContexts else masker.mask  # Store references to the contexts instead of the strings if requested
 
         sentences = []                      # List to store Sentence objects
-        sentenceTexts = nlp(text)           # Use SpaCy to tokenize the document into sentences
 
         # Fill the relations list
         for relation in doc.relations:
-            relationsInDoc.append((relation.id1, relation.id2))
+            relationsInDoc.add((relation.id1, relation.id2))
 
-        start = 0
         # Fill the sentences list
-        for senText in sentenceTexts.sents:
-            if len(senText.text) <= 1:
-                continue
-            start = text.find(senText.text, start)
-            end = start + len(senText.text)
-            sentences.append(Sentence(senText.text, start, end))
-            start = end
-
-        # Process annotations for each sentence
-        for ann in annotations:
-            for sen in sentences:
-                if ann.start >= sen.start and ann.end <= sen.end:
-                    if ann.id == '-1':
-                        continue
-                    for splitAnn in ann.id.split('|'):
-                        if len(ann.id.split('|')) > 1:
-                            tempAnn = copy.deepcopy(ann)
-                            tempAnn.id = splitAnn
-                            sen.addAnnotation(tempAnn)
-                        else:
-                            sen.addAnnotation(ann)
-
-
-        # Generate intra-sentential pairs
-        for sen in sentences:
-            chemicals = [ann for ann in sen.annotations if ann.type == 'Chemical']
-            diseases = [ann for ann in sen.annotations if ann.type == 'Disease']
-            for chem in chemicals:
-                for dis in diseases:
-                    # Check if the chemical-disease pair is in known relationships
-                    if (chem.id, dis.id) in relationsInDoc:
-                        pairsInDoc.append(Pair(chem, dis, maskOtherDiseasesInContext(text, dis, annotations), pmid, "intra", dis.start, dis.end))
-                    else:
-                        pairsInDoc.append(Pair(chem, dis, maskOtherDiseasesInContext(text, dis, annotations), pmid, "intra", 0, 0))
-
-        # Initialize the start and end indices for a window of sentences
-        start = 0
-        end = min(3, len(sentences) - 1)    # Window size limited to 3 or fewer sentences
-        
-        # Generate a list of annotations for sentences within the window
-        annsIn3Sentences = [[ann for ann in sen.annotations] for sen in sentences[start:end + 1]]
-
-        # Iterate through sentences to find intersentential pairs
-        for sen in sentences[:-1]:
-            for j in range(1, end - start + 1):
-                # Extract chemicals from the current sentence and diseases from the next within the window
-                currentChemicals = [ann for ann in annsIn3Sentences[0] if ann.type == 'Chemical']
-                nextDiseases = [ann for ann in annsIn3Sentences[j] if ann.type == 'Disease']
-
-                # For each chemical-disease pair found, create a Pair object and add to the pairs list.
-                for chem in currentChemicals:
-                    for dis in nextDiseases:
-                        # Check if the chemical-disease pair is in known relationships
-                        if (chem.id, dis.id) in relationsInDoc:
-                            pairsInDoc.append(Pair(chem, dis, maskOtherDiseasesInContext(text, dis, annotations), pmid, "intra", dis.start, dis.end))
-                        else:
-                            pairsInDoc.append(Pair(chem, dis, maskOtherDiseasesInContext(text, dis, annotations), pmid, "intra", 0, 0))
-
-                # Repeat the process for diseases in the current sentence and chemicals in the next.
-                currentDiseases = [ann for ann in annsIn3Sentences[0] if ann.type == 'Disease']
-                nextChemicals = [ann for ann in annsIn3Sentences[j] if ann.type == 'Chemical']
-                
-                for dis in currentDiseases:
-                    for chem in nextChemicals:
-                        if (chem.id, dis.id) in relationsInDoc:
-                            pairsInDoc.append(Pair(chem, dis, maskOtherDiseasesInContext(text, dis, annotations), pmid, "intra", dis.start, dis.end))
-                        else:
-                            pairsInDoc.append(Pair(chem, dis, maskOtherDiseasesInContext(text, dis, annotations), pmid, "intra", 0, 0))
-
-            # Slide the window one sentence forward.
-            start += 1
-            annsIn3Sentences = annsIn3Sentences[1:]
-            if end < len(sentences) - 1:
-                end += 1
-                annsIn3Sentences.append(sentences[end].annotations)
-        
-        pairs.append(pairsInDoc)
-
-    return pairs
+        for start, end in sentenceSpans:
+            sentences.append(Sentence(text[start:end], start, end))
+
+        # Assign the annotations to the sentences that contain them
+        sentenceIndex = placeAnnotations(sentences, annotations)
+
+        # Generate the intra-sentential and inter-sentential pairs
+        for chem, dis, pairType, related, mentions in enumeratePairs(sentences, relationsInDoc, typePairs, window, aggregate):
+            mentionPairs = mentions if mentions is not None else [(chem, dis)]
+
+            # Keep only the sentences covering the pair and contextMargin sentences around them if requested
+            contextWindow = None
+            contextOffset = 0
+            if contextMargin is not None:
+                contextWindow = sentenceIndex.window([ann for mentionPair in mentionPairs for ann in mentionPair], contextMargin)
+                contextOffset = contextWindow[0]
+
+            # Keep every mention of the disease unmasked
+            context = maskContext(*{mentionDis for _, mentionDis in mentionPairs}, window=contextWindow)
+
+            # Record the spans of the collapsed mention pairs within the document
+            if mentions is not None:
+                mentions = [(mentionChem.start, mentionChem.end, mentionDis.start, mentionDis.end) for mentionChem, mentionDis in mentions]
+
+            # The position of the disease is the label if the chemical-disease pair is in known relationships
+            if related:
+                pairsInDoc.append(Pair(chem, dis, context, pmid, pairType, dis.start - contextOffset, dis.end - contextOffset, mentions, contextOffset))
+            else:
+                pairsInDoc.append(Pair(chem, dis, context, pmid, pairType, 0, 0, mentions, contextOffset))
+
+        yield pairsInDoc
+
+# Function to create chemical-disease pairs from a list of documents
+def instanceConstruction(docs, batchSize=32, nProcess=1, lazyContexts=False, window=3, typePairs=TYPE_PAIRS, aggregate=False, contextMargin=None, sentenceCache=None, segmenter=None):
+    return list(iterInstances(docs, batchSize, nProcess, lazyContexts, window, typePairs, aggregate, contextMargin, segmenter, sentenceCache))
 
 if __name__ == '__main__':
-    # Load the document data from a file
-    with open('./CDR_Data/CDR.Corpus.v010516/CDR_TestSet.PubTator.txt', 'r') as fp:
-        docs = pubtator.load(fp)
+    # Parse the options of the sentence segmentation
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--batch-size', type=int, default=32, help='Number of documents sent to SpaCy at once')
+    parser.add_argument('--n-process', type=int, default=1, help='Number of processes used by SpaCy for sentence segmentation')
+    parser.add_argument('--lazy-contexts', action='store_true', help='Store references to the masked contexts that are built when they are needed')
+    parser.add_argument('--window', type=int, default=3, help='Number of following sentences that inter-sentential pairs can span')
+    parser.add_argument('--aggregate', action='store_true', help='Collapse the mention pairs into one pair per pair of entity ids')
+    parser.add_argument('--context-margin', type=int, default=None, help='Only keep the sentences covering the pair and this many sentences around them in the context')
+    parser.add_argument('--segmenter', choices=list(SEGMENTERS), default=DEFAULT_SEGMENTER, help='Backend used to split the documents into sentences')
+    parser.add_argument('--sentence-cache', default='./Preprocessed/sentenceCache.sqlite', help='SQLite file caching the sentence offsets of the documents')
+    parser.add_argument('--no-sentence-cache', action='store_true', help='Segment every document with SpaCy without reading or writing the cache')
+    args = parser.parse_args()
+
+    # Stream the document data from a file
+    docs = iterDocuments('./CDR_Data/CDR.Corpus.v010516/CDR_TestSet.PubTator.txt')
+
+    # Open the cache of the sentence offsets, which is shared by the scripts of every corpus and split
+    sentenceCache = None if args.no_sentence_cache else SentenceCache(args.sentence_cache)
 
     # Create pairs from the loaded documents
-    pairs = instanceConstruction(docs)
+    pairs = instanceConstruction(docs, args.batch_size, args.n_process, args.lazy_contexts, args.window, aggregate=args.aggregate, contextMargin=args.context_margin, sentenceCache=sentenceCache, segmenter=loadSegmenter(args.segmenter))
 
     # The directory that the code will store its outputs in
     output_dir = './Preprocessed/CDRTest'
@@ -1,91 +1,73 @@
+import argparse
+import itertools
+import multiprocessing
 import pickle
-import xml.etree.ElementTree as ET
 from preprocessCDR1 import Pair
 from bioc.pubtator.datastructure import PubTatorAnn
+from meshIndex import findAncestorDescriptors, iterDescriptors, loadMeshIndex
 
-# Function to remove the instances containing annotations that have more specific annotations in the document
-def hypernymFiltering(pairs, descriptorMap):
-    newPairs = []                           # List to store the result of this step
+# Roles of the annotations in a pair that are filtered, annotations are only compared with annotations of the same role
+ROLES = ('chemical', 'disease')
 
-    for pairsInDoc in pairs:
-        eliminatedIDs = set()               # Set to store the ids of annotations already eliminated 
-        newPairsInDoc = []                  # List to store new pairs in specific doc
-        
-        for i, currentPair in enumerate(pairsInDoc):
-            currentChemicalID = currentPair.chemical.id
-            currentDiseaseID = currentPair.disease.id
-            # Remove the pair if the chemical or disease is previously eliminated
-            if currentChemicalID in eliminatedIDs or currentDiseaseID in eliminatedIDs:
-                continue
-            
-            eliminated = False
-            # Compare with the chemical and diseases found later in the document and remove currentPair if more general 
-            # (Replaced the name TreeNumber with Index)
-            for tempPair in pairsInDoc[i + 1:]:
-                
-                tempChemicalID = tempPair.chemical.id
-                tempDiseaseID = tempPair.disease.id
-                # Check for chemical
-                if currentChemicalID in descriptorMap and tempChemicalID in descriptorMap:
-                    for currentIndex in descriptorMap[currentChemicalID]:
-                        for tempIndex in descriptorMap[tempChemicalID]:
-                            if currentIndex in tempIndex and currentIndex != tempIndex:
-                                eliminatedIDs.add(currentChemicalID)
-                                eliminated = True
-                                # No need to check other temp indices
-                                break
-                        # No need to check other current indices
-                        if eliminated:
-                            break
-                    # No need to check other temp pairs
-                    if eliminated:
-                        break
-                
-                # Same check for disease
-                if currentDiseaseID in descriptorMap and tempDiseaseID in descriptorMap:
-                    for currentIndex in descriptorMap[currentDiseaseID]:
-                        for tempIndex in descriptorMap[tempDiseaseID]:
-                            if currentIndex in tempIndex and currentIndex != tempIndex:
-                                eliminatedIDs.add(currentDiseaseID)
-                                eliminated = True
-                                break
-                        if eliminated:
-                            break
-                    if eliminated:
-                        break
+workerDescriptorMap = None                  # Descriptor map of a worker process
+
+# Function to remove the pairs of a document containing annotations that have more specific annotations in the document
+def hypernymFilteringInDoc(pairsInDoc, descriptorMap):
+    # Find the ids of every role that have a more specific id of the same role in the document
+    eliminatedIDs = {role: findAncestorDescriptors({getattr(pair, role).id for pair in pairsInDoc}, descriptorMap) for role in ROLES}
+
+    # Keep the pairs whose annotations are not eliminated
+    return [pair for pair in pairsInDoc if not any(getattr(pair, role).id in eliminatedIDs[role] for role in ROLES)]
+
+# Function to store the descriptor map in a worker process
+def initFilteringWorker(descriptorMap):
+    global workerDescriptorMap
+    workerDescriptorMap = descriptorMap
+
+# Function to filter the pairs of a document in a worker process
+def filterDocInWorker(pairsInDoc):
+    return hypernymFilteringInDoc(pairsInDoc, workerDescriptorMap)
 
-            # Store new pair if it is not eliminated
-            if not eliminated:
-                newPairsInDoc.append(currentPair)
-        
-        # Add to the new list of pairs
-        newPairs.append(newPairsInDoc)
+# Function to filter a stream of documents, yielding the filtered pairs of every document in order
+# With nProcess > 1 the documents are filtered in a pool of processes, each receiving the descriptor map once
+def iterHypernymFiltering(pairs, descriptorMap, nProcess=1, chunkSize=16):
+    if nProcess > 1:
+        pairs = iter(pairs)
+        with multiprocessing.Pool(nProcess, initializer=initFilteringWorker, initargs=(descriptorMap,)) as pool:
+            # Send the documents in groups of a few chunks per process so that the stream is not read ahead of the results
+            while True:
+                group = list(itertools.islice(pairs, nProcess * chunkSize * 4))
+                if not group:
+                    break
+                yield from pool.map(filterDocInWorker, group, chunksize=chunkSize)
+        return
 
-    return newPairs
+    for pairsInDoc in pairs:
+        yield hypernymFilteringInDoc(pairsInDoc, descriptorMap)
+
+# Function to remove the instances containing annotations that have more specific annotations in the document
+def hypernymFiltering(pairs, descriptorMap, nProcess=1):
+    return list(iterHypernymFiltering(pairs, descriptorMap, nProcess))
 
 # Function to loads a dictionary mapping DescriptorUI to their respective TreeNumbers from an XML tree
 def loadDescriptorMap(meshFile):
-    tree = ET.parse(meshFile)
-    root = tree.getroot()
-
-    descriptorMap = {}
-    for descriptor in root.findall('.//DescriptorRecord'):
-        ui = descriptor.find('DescriptorUI').text
-        treeNumbers = [tn.text for tn in descriptor.findall('.//TreeNumber')]
-        descriptorMap[ui] = treeNumbers
-    
-    return descriptorMap
+    return dict(iterDescriptors(meshFile))
 
 if __name__ == '__main__':
+    # Parse the options of the filtering
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--n-process', type=int, default=1, help='Number of processes used to filter the documents')
+    args = parser.parse_args()
+
     # Load the pairs that were produced by the first stage
     with open('./Preprocessed/CDRTest/pairs1.pkl', 'rb') as input_file:
         pairs = pickle.load(input_file)
     
-    # Load the annotation hierarchy map from the MeSH dataset
-    descriptorMap = loadDescriptorMap('./MeSH/desc2024.xml')
+    # Load the annotation hierarchy map from the MeSH dataset, the index is built on the first run and memory-mapped afterwards
+    descriptorMap = loadMeshIndex('./MeSH/desc2024.xml')
 
     # Create pairs from the loaded documents
-    pairs = hypernymFiltering(pairs, descriptorMap)
+    pairs = hypernymFiltering(pairs, descriptorMap, args.n_process)
 
     # Open a file to write the output
     with open('./Preprocessed/CDRTest/pairs2.pkl', 'wb') as outputFile:
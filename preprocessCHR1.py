@@ -1,11 +1,18 @@
-from bioc import pubtator
-import spacy
+from pubtatorReader import iterDocuments
+import argparse
 import pickle
-import copy
 import os
+from annotationPlacement import placeAnnotations
+from contextMasking import ContextMasker
+from pairEnumeration import enumeratePairs
+from records import Record, compactAnnotations
+from sentenceCache import SentenceCache
+from sentenceSegmentation import DEFAULT_SEGMENTER, SEGMENTERS, loadSegmenter, segmentDocuments
 
 # A class to represent sentences within the document
-class Sentence:
+class Sentence(Record):
+    __slots__ = ('text', 'start', 'end', 'annotations')
+
     def __init__(self, text, start, end, annotations=None):
         self.text = text                                        # Text content of the sentence
         self.start = start                                      # Starting index of the sentence within the document
@@ -16,131 +23,114 @@ class Sentence:
         self.annotations.append(annotation)
 
 # A class for chemical-disease pairs with context and metadata
-class Pair:
-    def __init__(self, chemical1, chemical2, context, pmid, pairType, groundTruthStart, groundTruthEnd):
+class Pair(Record):
+    __slots__ = ('chemical1', 'chemical2', 'context', 'pmid', 'pairType', 'groundTruthStart', 'groundTruthEnd', 'mentions', 'contextOffset')
+
+    def __init__(self, chemical1, chemical2, context, pmid, pairType, groundTruthStart, groundTruthEnd, mentions=None, contextOffset=0):
         self.chemical1 = chemical1                              # Chemical 1
         self.chemical2 = chemical2                              # Chemical 2
-        self.context = context                                  # Context in which the pair occurs, with masking applied
+        self.context = context                                  # Context in which the pair occurs with masking applied, either a string or a LazyContext
         self.pmid = pmid                                        # PubMed ID of the article
         self.pairType = pairType                                # Specifies whether the pair is intra-sentential or inter-sentential
         self.groundTruthStart = groundTruthStart                # Starting position of the disease that we want to predict, it serves as the label of the datapoint
         self.groundTruthEnd = groundTruthEnd                    # Ending position of the disease that we want to predict, it serves as the label of the datapoint
+        self.mentions = mentions                                # Spans (headStart, headEnd, tailStart, tailEnd) of the mention pairs collapsed into this pair, None if it is a single mention pair
+        self.contextOffset = contextOffset                      # Position of the context within the document, the ground truth positions are relative to the context
 
     # Representation of a Pair object when printed
     def __repr__(self):
-        return f"Pair(chemical1={self.chemical1.text}, chemical2={self.chemical2.text}, context=[{self.context[:30]}...], pmid={self.pmid}, pair_type={self.pairType})"
+        return f"Pair(chemical1={self.chemical1.text}, chemical2={self.chemical2.text}, context=[{str(self.context)[:30]}...], pmid={self.pmid}, pair_type={self.pairType})"
 
 # Function to mask all chemicals in the context except for the target chemical
 def maskOtherChemicalsInContext(context, targetChemicalAnnotation1, targetChemicalAnnotation2, allAnnotations):
-    MASK_TOKEN = "[***]"                    # Token used to replace masked diseases
-    maskedContext = context                 # Copy of the context to apply masking to
-    annotationString = ""                   # String to store formatted annotations
-
-    # Keep track of adjustments in indexing due to masking
-    offset = 0
-    for ann in allAnnotations:
-        # Apply masking to chemicals that are not the target
-        if ann.type == 'ChemMet' and ann.start != targetChemicalAnnotation1.start and ann.end != targetChemicalAnnotation1.end and ann.start != targetChemicalAnnotation2.start and ann.end != targetChemicalAnnotation2.end:
-            maskedContext = maskedContext[:ann.start - offset] + MASK_TOKEN + maskedContext[ann.end - offset:]
-            offset += len(ann.text) - len(MASK_TOKEN)
-        else:
-            # Accumulate annotations for inclusion in the context
-            annotationString += f"{ann.pmid} {ann.start} {ann.end} {ann.text} {ann.type} {ann.id}\n"
-
-    # Return the masked context concatenated with the annotation string
-    return maskedContext + "\n" + annotationString
-
-# Function to create chemical-disease pairs from a list of documents
-def instanceConstruction(docs):
-    pairs = []                              # List to store all the pairs
-    nlp = spacy.load("en_core_sci_scibert") # Load a SpaCy model specialized in biomedical text
-
-    for doc in docs[:5]:
+    return ContextMasker(context, allAnnotations, 'ChemMet').mask(targetChemicalAnnotation1, targetChemicalAnnotation2)
+
+# Entity types of the (head, tail) pairs that are generated
+TYPE_PAIRS = [('ChemMet', 'ChemMet')]
+
+# Function to create chemical-chemical pairs from a stream of documents, yielding the list of pairs of every document in order
+# A loaded segmenter can be passed, otherwise the default segmenter is loaded here
+# If a SentenceCache is given, the sentence offsets of the documents that were segmented before are read from it instead of SpaCy
+def iterInstances(docs, batchSize=32, nProcess=1, lazyContexts=False, window=3, typePairs=TYPE_PAIRS, aggregate=False, contextMargin=None, segmenter=None, sentenceCache=None):
+    if segmenter is None:
+        segmenter = loadSegmenter()         # Load a SpaCy model specialized in biomedical text with only the sentence boundary components
+
+    # Stream the documents through the segmenter in batches to split them into sentences
+    for doc, sentenceSpans in segmentDocuments(docs, segmenter, batchSize, nProcess, sentenceCache):
         pairsInDoc = []                     # Pairs in specific doc
-        relationsInDoc = []                 # Relations in specific doc
-        annotations = doc.annotations       # Extract annotations from the document
+        relationsInDoc = set()              # Relations in specific doc
+        annotations = compactAnnotations(doc.annotations)  # Extract annotations from the document as compact records
         text = doc.text                     # Document text
         pmid = doc.pmid                     # PubMed ID of the document
+        masker = ContextMasker(text, annotations, 'ChemMet')   # Masks the other chemicals, once for every distinct pair of targets
+        maskContext = masker.lazy if lazyContexts else masker.mask  # Store references to the contexts instead of the strings if requested
 
         sentences = []                      # List to store Sentence objects
-        sentenceTexts = nlp(text)           # Use SpaCy to tokenize the document into sentences
 
         # Fill the relations list
         for relation in doc.relations:
-            relationsInDoc.append((relation.id1, relation.id2))
+            relationsInDoc.add((relation.id1, relation.id2))
 
-        start = 0
         # Fill the sentences list
-        for senText in sentenceTexts.sents:
-            if len(senText.text) <= 1:
-                continue
-            start = text.find(senText.text, start)
-            end = start + len(senText.text)
-            sentences.append(Sentence(senText.text, start, end))
-            start = end
-
-        # Process annotations for each sentence
-        for ann in annotations:
-            for sen in sentences:
-                if ann.start >= sen.start and ann.end <= sen.end:
-                    if ann.id == '-1':
-                        continue
-                    sen.addAnnotation(ann)
-
-
-        # Generate intra-sentential pairs
-        for sen in sentences:
-            chemicals = [ann for ann in sen.annotations if ann.type == 'ChemMet']
-            for chem1 in chemicals:
-                for chem2 in chemicals:
-                    if chem1.id != chem2.id:
-                        if (chem1.id, chem2.id) in relationsInDoc:
-                            pairsInDoc.append(Pair(chem1, chem2, maskOtherChemicalsInContext(text, chem1, chem2, annotations), pmid, "intra", chem2.start, chem2.end))
-                        else:
-                            pairsInDoc.append(Pair(chem1, chem2, maskOtherChemicalsInContext(text, chem1, chem2, annotations), pmid, "intra", 0, 0))
-
-        # Initialize the start and end indices for a window of sentences
-        start = 0
-        end = min(3, len(sentences) - 1)    # Window size limited to 3 or fewer sentences
-        
-        # Generate a list of annotations for sentences within the window
-        annsIn3Sentences = [[ann for ann in sen.annotations] for sen in sentences[start:end + 1]]
-
-        # Iterate through sentences to find intersentential pairs
-        for sen in sentences[:-1]:
-            for j in range(1, end - start + 1):
-                # Extract chemicals from the current sentence and chemicals from the next within the window
-                currentChemicals = [ann for ann in annsIn3Sentences[0] if ann.type == 'ChemMet']
-                nextChemicals = [ann for ann in annsIn3Sentences[j] if ann.type == 'ChemMet']
-
-                # For each chemical-chemical pair found, create a Pair object and add to the pairs list.
-                for chem1 in currentChemicals:
-                    for chem2 in nextChemicals:
-                        if chem1.id != chem2.id:
-                            if (chem1.id, chem2.id) in relationsInDoc:
-                                pairsInDoc.append(Pair(chem1, chem2, maskOtherChemicalsInContext(text, chem1, chem2, annotations), pmid, "inter", chem2.start, chem2.end))
-                            else:
-                                pairsInDoc.append(Pair(chem1, chem2, maskOtherChemicalsInContext(text, chem1, chem2, annotations), pmid, "inter", 0, 0))
-
-            # Slide the window one sentence forward.
-            start += 1
-            annsIn3Sentences = annsIn3Sentences[1:]
-            if end < len(sentences) - 1:
-                end += 1
-                annsIn3Sentences.append(sentences[end].annotations)
-        
-        pairs.append(pairsInDoc)
-
-    return pairs
+        for start, end in sentenceSpans:
+            sentences.append(Sentence(text[start:end], start, end))
+
+        # Assign the annotations to the sentences that contain them
+        sentenceIndex = placeAnnotations(sentences, annotations, splitCompositeIDs=False)
+
+        # Generate the intra-sentential and inter-sentential pairs
+        for chem1, chem2, pairType, related, mentions in enumeratePairs(sentences, relationsInDoc, typePairs, window, aggregate):
+            mentionPairs = mentions if mentions is not None else [(chem1, chem2)]
+
+            # Keep only the sentences covering the pair and contextMargin sentences around them if requested
+            contextWindow = None
+            contextOffset = 0
+            if contextMargin is not None:
+                contextWindow = sentenceIndex.window([ann for mentionPair in mentionPairs for ann in mentionPair], contextMargin)
+                contextOffset = contextWindow[0]
+
+            # Keep every mention of both chemicals unmasked
+            context = maskContext(*{ann for mentionPair in mentionPairs for ann in mentionPair}, window=contextWindow)
+
+            # Record the spans of the collapsed mention pairs within the document
+            if mentions is not None:
+                mentions = [(mentionChem1.start, mentionChem1.end, mentionChem2.start, mentionChem2.end) for mentionChem1, mentionChem2 in mentions]
+
+            # The position of the second chemical is the label if the chemical-chemical pair is in known relationships
+            if related:
+                pairsInDoc.append(Pair(chem1, chem2, context, pmid, pairType, chem2.start - contextOffset, chem2.end - contextOffset, mentions, contextOffset))
+            else:
+                pairsInDoc.append(Pair(chem1, chem2, context, pmid, pairType, 0, 0, mentions, contextOffset))
+
+        yield pairsInDoc
+
+# Function to create chemical-chemical pairs from a list of documents
+def instanceConstruction(docs, batchSize=32, nProcess=1, lazyContexts=False, window=3, typePairs=TYPE_PAIRS, aggregate=False, contextMargin=None, sentenceCache=None, segmenter=None):
+    return list(iterInstances(docs[:5], batchSize, nProcess, lazyContexts, window, typePairs, aggregate, contextMargin, segmenter, sentenceCache))
 
 
 if __name__ == '__main__':
+    # Parse the options of the sentence segmentation
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--batch-size', type=int, default=32, help='Number of documents sent to SpaCy at once')
+    parser.add_argument('--n-process', type=int, default=1, help='Number of processes used by SpaCy for sentence segmentation')
+    parser.add_argument('--lazy-contexts', action='store_true', help='Store references to the masked contexts that are built when they are needed')
+    parser.add_argument('--window', type=int, default=3, help='Number of following sentences that inter-sentential pairs can span')
+    parser.add_argument('--aggregate', action='store_true', help='Collapse the mention pairs into one pair per pair of entity ids')
+    parser.add_argument('--context-margin', type=int, default=None, help='Only keep the sentences covering the pair and this many sentences around them in the context')
+    parser.add_argument('--segmenter', choices=list(SEGMENTERS), default=DEFAULT_SEGMENTER, help='Backend used to split the documents into sentences')
+    parser.add_argument('--sentence-cache', default='./Preprocessed/sentenceCache.sqlite', help='SQLite file caching the sentence offsets of the documents')
+    parser.add_argument('--no-sentence-cache', action='store_true', help='Segment every document with SpaCy without reading or writing the cache')
+    args = parser.parse_args()
+
     # Load the document data from a file
-    with open('./CHR_Data/CHR_corpus/train.pubtator', 'r', encoding='utf-8') as fp:
-        docs = pubtator.load(fp)
+    docs = list(iterDocuments('./CHR_Data/CHR_corpus/train.pubtator'))
+
+    # Open the cache of the sentence offsets, which is shared by the scripts of every corpus and split
+    sentenceCache = None if args.no_sentence_cache else SentenceCache(args.sentence_cache)
 
     # Create pairs from the loaded documents
-    pairs = instanceConstruction(docs)
+    pairs = instanceConstruction(docs, args.batch_size, args.n_process, args.lazy_contexts, args.window, aggregate=args.aggregate, contextMargin=args.context_margin, sentenceCache=sentenceCache, segmenter=loadSegmenter(args.segmenter))
 
     # The directory that the code will store its outputs in
     output_dir = './Preprocessed/CHRTraining'
@@ -1,9 +1,12 @@
 import pickle
 from preprocessCHR1 import Pair
 from bioc.pubtator.datastructure import PubTatorAnn
+from records import Record
 
 # A class to represent the input to the model
-class Input:
+class Input(Record):
+    __slots__ = ('context', 'query', 'chemical1ID', 'chemical2ID', 'groundTruthStart', 'groundTruthEnd', 'mentions', 'contextOffset')
+
     def __init__(self, pair):
         self.context = pair.context             # Context in which the pair occurs
         self.query = self.createQuery(pair)     # Query that asks which disease is induced
@@ -11,20 +14,23 @@ class Input:
         self.chemical2ID = pair.chemical2.id
         self.groundTruthStart = pair.groundTruthStart
         self.groundTruthEnd = pair.groundTruthEnd
+        self.mentions = pair.mentions           # Spans of the mention pairs collapsed into the pair, None for a single mention pair
+        self.contextOffset = pair.contextOffset # Position of the context within the document
 
     def createQuery(self, pair):
         return f"what chemical does {pair.chemical1.text} react with"
 
-# Function to construct the input consisting of the context and query
-def queryConstruction(pairs):
-    inputs = []                                 # List to store the inputs to the model
+# Function to construct the inputs of a stream of documents, yielding the list of inputs of every document in order
+def iterQueryConstruction(pairs):
     for pairsInDoc in pairs:
         inputsInDoc = []
         for pair in pairsInDoc:
             inputsInDoc.append(Input(pair))
-        inputs.append(inputsInDoc)
+        yield inputsInDoc
 
-    return inputs
+# Function to construct the input consisting of the context and query
+def queryConstruction(pairs):
+    return list(iterQueryConstruction(pairs))
 
 if __name__ == '__main__':
     # Load the pairs that were produced by the second stage
@@ -1,77 +1,57 @@
+import argparse
 import pickle
 from transformers import BertTokenizerFast
 from preprocessCHR2 import Input
-from torch.utils.data import DataLoader, Dataset
 import torch
-
-# Set device (GPU if available)
-device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
-
-# Custom dataset for efficiently handling input from a single document
-class CustomDataset(Dataset):
-    def __init__(self, inputs, tokenizer):
-        self.inputs = inputs                        # Store input data
-        self.tokenizer = tokenizer                  # Store tokenizer
-
-    def __len__(self):
-        return len(self.inputs)
-
-    def __getitem__(self, idx):
-        input = self.inputs[idx]                    # Get input data by index
-
-        # Create the input sequence with [CLS] and [SEP] tokens
-        input_sequence = f"[CLS] {input.query} [SEP] {input.context} [SEP]"
-
-        # Tokenize the input sequence
-        tokens = self.tokenizer.encode_plus(
-            input_sequence,
-            max_length=512,
-            truncation=True,
-            padding='max_length',
-            return_offsets_mapping=True,            # Include offset mappings
-            return_tensors='pt'
-        )
-
-        # Find the starting and ending token indices for the ground truth span
-        start_token_index = self.find_token_index(input.groundTruthStart, tokens['offset_mapping'].squeeze(0))
-        end_token_index = self.find_token_index(input.groundTruthEnd, tokens['offset_mapping'].squeeze(0))
-
-        return (
-            tokens['input_ids'].squeeze(0).to(device),          # Input IDs
-            tokens['attention_mask'].squeeze(0).to(device),     # Attention mask
-            input.chemical1ID,                                  # Chemical 1 ID
-            input.chemical2ID,                                  # Chemical 2 ID
-            torch.tensor(start_token_index).to(device),         # Ground truth start token index
-            torch.tensor(end_token_index).to(device)            # Ground truth end token index
-        )
-
-    # Helper function to find the index of the token that corresponds to the given character position
-    def find_token_index(self, char_position, offset_mapping):
-        for i, (start, end) in enumerate(offset_mapping):
-            if start <= char_position <= end:
-                return i
-        return -1
+from tokenization import tokenizeDocuments, ContextTokenCache, MAX_LENGTH
+from tokenizedStore import TokenizedShardWriter
 
 # Function to tokenize input data and save the results to a file
-def tokenize_inputs_and_save(docs_inputs, tokenizer, output_file_path, batch_size=16):
-    i = 0
-    for inputs in docs_inputs:
-        dataset = CustomDataset(inputs, tokenizer)
-        data_loader = DataLoader(dataset, batch_size=batch_size, shuffle=False, num_workers=4)
+# The inputs of many documents are tokenized together in batches of tokenization_batch_size, the output keeps one group of batches per document
+# With dynamic_length every batch is padded to its longest input instead of 512 tokens
+# Identical contexts are tokenized once through a cache of at most context_cache_tokens tokens, 0 disables the cache
+def tokenize_inputs_and_save(docs_inputs, tokenizer, output_file_path, batch_size=16, tokenization_batch_size=1024, dynamic_length=False, context_cache_tokens=2000000):
+    padding = 'longest' if dynamic_length else 'max_length'
+    cache = ContextTokenCache(tokenizer, context_cache_tokens) if context_cache_tokens else None
+    with open(output_file_path, 'ab') as outputFile:
+        for i, (inputs, input_ids, attention_masks, groundTruthStarts, groundTruthEnds) in enumerate(tokenizeDocuments(docs_inputs, tokenizer, tokenization_batch_size, padding=padding, cache=cache)):
+            # Write the tokenized data of the document in batches of batch_size inputs
+            for start in range(0, len(inputs), batch_size):
+                end = start + batch_size
+                width = attention_masks[start:end].sum(axis=1).max() if dynamic_length else MAX_LENGTH
+                chemical1IDs = [input.chemical1ID for input in inputs[start:end]]
+                chemical2IDs = [input.chemical2ID for input in inputs[start:end]]
+                # Copy the slices so that every pickled tensor only holds its own rows
+                pickle.dump((
+                    torch.from_numpy(input_ids[start:end, :width].copy()),
+                    torch.from_numpy(attention_masks[start:end, :width].copy()),
+                    chemical1IDs,
+                    chemical2IDs,
+                    torch.from_numpy(groundTruthStarts[start:end].copy()),
+                    torch.from_numpy(groundTruthEnds[start:end].copy())
+                ), outputFile)
+            print("Input #" + str(i) + " done.")
 
-        # Write the tokenized data to the output file
-        with open(output_file_path, 'ab') as outputFile:
-            for input_ids, attention_masks, chemical1IDs, chemical2IDs, groundTruthStarts, groundTruthEnds in data_loader:
-                # Move tensors to CPU before saving them to pickle
-                input_ids = input_ids.cpu()
-                attention_masks = attention_masks.cpu()
-                groundTruthStarts = groundTruthStarts.cpu()
-                groundTruthEnds = groundTruthEnds.cpu()
-                pickle.dump((input_ids, attention_masks, chemical1IDs, chemical2IDs, groundTruthStarts, groundTruthEnds), outputFile)
-        print("Input #" + str(i) + " done.")
-        i += 1
+# Function to tokenize input data and save the results to a directory of memory-mapped shards that can be read with TokenizedShardDataset
+# With dynamic_length the sequences are stored without padding
+def tokenize_inputs_and_save_shards(docs_inputs, tokenizer, output_directory, tokenization_batch_size=1024, shard_size=65536, dynamic_length=False, context_cache_tokens=2000000):
+    padding = 'longest' if dynamic_length else 'max_length'
+    cache = ContextTokenCache(tokenizer, context_cache_tokens) if context_cache_tokens else None
+    with TokenizedShardWriter(output_directory, len(tokenizer), MAX_LENGTH, shard_size, ragged=dynamic_length, padTokenId=tokenizer.pad_token_id) as writer:
+        for i, (inputs, input_ids, attention_masks, groundTruthStarts, groundTruthEnds) in enumerate(tokenizeDocuments(docs_inputs, tokenizer, tokenization_batch_size, padding=padding, cache=cache)):
+            writer.addDocument(input_ids, attention_masks, groundTruthStarts, groundTruthEnds, [(input.chemical1ID, input.chemical2ID) for input in inputs])
+            print("Input #" + str(i) + " done.")
 
 if __name__ == '__main__':
+    # Parse the options of the tokenization
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--tokenizer-batch-size', type=int, default=1024, help='Number of inputs sent to the tokenizer at once, across documents')
+    parser.add_argument('--format', choices=['pickle', 'shards'], default='pickle', help='Write a stream of pickled batches or a directory of memory-mapped shards')
+    parser.add_argument('--shard-size', type=int, default=65536, help='Number of inputs per shard in the shards format')
+    parser.add_argument('--context-cache-tokens', type=int, default=2000000, help='Maximum number of context tokens kept to tokenize identical contexts once, 0 disables the cache')
+    parser.add_argument('--dynamic-length', action='store_true', help='Pad every batch to its longest input, or store the shards without padding')
+    args = parser.parse_args()
+
     # Load the inputs that were produced by the third stage
     with open('./Preprocessed/CHRTraining/input.pkl', 'rb') as inputFile:
         docs_inputs = pickle.load(inputFile)
@@ -79,9 +59,13 @@ if __name__ == '__main__':
     # Initialize tokenizer
     tokenizer = BertTokenizerFast.from_pretrained('dmis-lab/biobert-base-cased-v1.2')
 
-    # Clear the output file first to avoid appending to an old file
-    with open('./Preprocessed/CHRTraining/tokenizedInputs.pkl', 'wb') as outputFile:
-        pass
+    if args.format == 'shards':
+        # Tokenize inputs and save them as shards, keeping the offsets of every document
+        tokenize_inputs_and_save_shards(docs_inputs, tokenizer, './Preprocessed/CHRTraining/tokenizedInputs', args.tokenizer_batch_size, args.shard_size, args.dynamic_length, args.context_cache_tokens)
+    else:
+        # Clear the output file first to avoid appending to an old file
+        with open('./Preprocessed/CHRTraining/tokenizedInputs.pkl', 'wb') as outputFile:
+            pass
 
-    # Tokenize inputs and save, maintaining the 2D list structure
-    tokenize_inputs_and_save(docs_inputs, tokenizer, './Preprocessed/CHRTraining/tokenizedInputs.pkl')
+        # Tokenize inputs and save, maintaining the 2D list structure
+        tokenize_inputs_and_save(docs_inputs, tokenizer, './Preprocessed/CHRTraining/tokenizedInputs.pkl', tokenization_batch_size=args.tokenizer_batch_size, dynamic_length=args.dynamic_length, context_cache_tokens=args.context_cache_tokens)
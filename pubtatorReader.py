@@ -0,0 +1,158 @@
+import argparse
+import mmap
+from bioc.pubtator.datastructure import PubTator, PubTatorRel
+from bioc.pubtator.decoder import loads_ann
+
+# Projections of the documents, every projection only parses the fields it names and leaves the others empty
+ALL = 'all'
+TEXT_ANNOTATIONS = 'text+annotations'
+ANNOTATIONS = 'annotations'
+RELATIONS = 'relations'
+
+# Fields parsed by every projection as (text, annotations, relations)
+PROJECTIONS = {
+    ALL: (True, True, True),
+    TEXT_ANNOTATIONS: (True, True, False),
+    ANNOTATIONS: (False, True, False),
+    RELATIONS: (False, False, True),
+}
+
+# Function to find the PubMed ID and the kind of a title or abstract line ('t' or 'a'), returns (None, None) for the other lines
+# A text line starts with the PubMed ID followed by |t| or |a|, the PubMed ID never contains a bar
+def textLine(line):
+    bar = line.find('|')
+    if bar >= 0 and line[bar + 1:bar + 2] in ('t', 'a') and line[bar + 2:bar + 3] == '|':
+        return line[:bar], line[bar + 1]
+    return None, None
+
+# Function to parse PubTator lines into documents, only the fields of the projection are parsed
+# A document ends at an empty line and is kept if it has a PubMed ID and a title or an abstract, as in bioc.pubtator
+def parseLines(lines, projection=ALL):
+    withText, withAnnotations, withRelations = PROJECTIONS[projection]
+    doc = PubTator()
+    hasText = False                         # Whether the document has a title or an abstract that is not empty
+    for i, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line:
+            if doc.pmid and hasText:
+                yield doc
+            doc = PubTator()
+            hasText = False
+            continue
+
+        pmid, kind = textLine(line)
+        if pmid is not None:
+            doc.pmid = pmid
+            text = line[len(pmid) + 3:]
+            hasText = hasText or bool(text)
+            if withText:
+                if kind == 't':
+                    doc.title = text
+                else:
+                    doc.abstract = text
+            continue
+
+        # Annotations have 6 or 7 fields and relations 4 or 5, the other fields are only split if they are needed
+        tabs = line.count('\t')
+        if tabs >= 5:
+            if withAnnotations:
+                doc.add_annotation(loads_ann(line.split('\t')))
+        elif tabs in (3, 4):
+            if withRelations:
+                doc.add_relation(PubTatorRel(*line.split('\t')))
+        else:
+            print('%i: Cannot parse: "%r"' % (i, line))
+
+    if doc.pmid and hasText:
+        yield doc
+
+# Function to stream the documents of a PubTator file, the file is read line by line and a document is parsed when it ends
+def iterDocuments(path, projection=ALL):
+    with open(path, 'r', encoding='utf-8') as fp:
+        yield from parseLines(fp, projection)
+
+# An index of the byte ranges of the documents of a PubTator file, the documents are read from a memory map of the file
+# The index only looks at the first characters of every line, the documents are parsed when they are read
+class PubTatorIndex:
+    def __init__(self, path):
+        self.path = path                                        # Path of the PubTator file
+        self.pmids = []                                         # PubMed IDs of the documents in the order of the file
+        self.spans = []                                         # (start, end) byte offsets of the documents in the order of the file
+        self.positions = {}                                     # Position of the first document of every PubMed ID
+        self.map = None                                         # Memory map of the file, opened when a document is read
+
+        start = None                                            # Byte offset of the first line of the current document
+        pmid = None                                             # PubMed ID of the current document, set by its title or abstract line
+        offset = 0
+        with open(path, 'rb') as fp:
+            for line in fp:
+                if line.strip():
+                    if start is None:
+                        start = offset
+                    if pmid is None:
+                        bar = line.find(b'|')
+                        if bar >= 0 and line[bar + 1:bar + 3] in (b't|', b'a|'):
+                            pmid = line[:bar].strip().decode('utf-8')
+                elif start is not None:
+                    self.add(pmid, start, offset)
+                    start = pmid = None
+                offset += len(line)
+        if start is not None:
+            self.add(pmid, start, offset)
+
+    # Adds a document to the index, the documents without a title or abstract line are left out
+    def add(self, pmid, start, end):
+        if pmid is None:
+            return
+        self.positions.setdefault(pmid, len(self.pmids))
+        self.pmids.append(pmid)
+        self.spans.append((start, end))
+
+    # The memory map is not pickled, an index sent to another process maps the file again
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['map'] = None
+        return state
+
+    def __len__(self):
+        return len(self.pmids)
+
+    def __contains__(self, pmid):
+        return pmid in self.positions
+
+    # Returns the document at a position of the file, or None if its title and abstract are empty
+    def documentAt(self, position, projection=ALL):
+        if self.map is None:
+            with open(self.path, 'rb') as fp:
+                self.map = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        start, end = self.spans[position]
+        docs = list(parseLines(self.map[start:end].decode('utf-8').splitlines(), projection))
+        return docs[0] if docs else None
+
+    # Returns the first document of a PubMed ID
+    def document(self, pmid, projection=ALL):
+        return self.documentAt(self.positions[pmid], projection)
+
+    # Yields (position, document) for the documents at the given positions in order, skipping the documents whose title and abstract are empty
+    def documentsAt(self, positions, projection=ALL):
+        for position in positions:
+            doc = self.documentAt(position, projection)
+            if doc is not None:
+                yield position, doc
+
+    def close(self):
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+
+if __name__ == '__main__':
+    # Print documents of a PubTator file by PubMed ID without parsing the rest of the file
+    parser = argparse.ArgumentParser(description='Print documents of a PubTator file by PubMed ID')
+    parser.add_argument('path', help='PubTator file')
+    parser.add_argument('pmids', nargs='+', help='PubMed IDs of the documents to print')
+    args = parser.parse_args()
+
+    index = PubTatorIndex(args.path)
+    for pmid in args.pmids:
+        print(index.document(pmid) if pmid in index else f"{pmid} is not in {args.path}")
+    index.close()
@@ -0,0 +1,32 @@
+import sys
+
+# A base class for compact records, the fields are stored in __slots__ and pickled as a plain tuple of values
+class Record:
+    __slots__ = ()
+
+    def __getstate__(self):
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+    def __setstate__(self, state):
+        for name, value in zip(self.__slots__, state):
+            setattr(self, name, value)
+
+# A compact annotation with the same attributes as PubTatorAnn
+class Annotation(Record):
+    __slots__ = ('pmid', 'start', 'end', 'text', 'type', 'id', 'others')
+
+    def __init__(self, pmid, start, end, text, type, id, others=()):
+        self.pmid = sys.intern(pmid)                            # PubMed ID of the article, shared between the annotations of a document
+        self.start = start                                      # Starting index of the annotation within the document
+        self.end = end                                          # Ending index of the annotation within the document
+        self.text = text                                        # Text of the annotation
+        self.type = sys.intern(type)                            # Type of the annotation (Chemical, Disease, ChemMet)
+        self.id = sys.intern(id)                                # Concept id of the annotation, it may be composite
+        self.others = tuple(others)                             # Extra fields of the annotation line after the id
+
+    def __str__(self):
+        return '%s\t%s\t%s\t%s\t%s\t%s' % (self.pmid, self.start, self.end, self.text, self.type, self.id)
+
+# Function to convert PubTator annotations to compact annotations
+def compactAnnotations(annotations):
+    return [Annotation(ann.pmid, ann.start, ann.end, ann.text, ann.type, ann.id, getattr(ann, 'others', ())) for ann in annotations]
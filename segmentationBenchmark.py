@@ -0,0 +1,83 @@
+import argparse
+import time
+import preprocessCDR1
+from pubtatorReader import TEXT_ANNOTATIONS, iterDocuments
+from sentenceSegmentation import SEGMENTERS, loadSegmenter
+
+# A segmenter that returns sentence offsets computed before, used to build the pairs of every backend without segmenting again
+class PrecomputedSegmenter:
+    def __init__(self, offsetsByText):
+        self.offsetsByText = offsetsByText                      # Sentence offsets keyed by the text of the document
+        self.version = "precomputed"
+
+    def segment(self, texts, batchSize=32, nProcess=1):
+        for text in texts:
+            yield self.offsetsByText[text]
+
+# Function to segment the documents with a backend, returns the sentence offsets of every document and the time it took
+def timeSegmenter(segmenter, texts, batchSize):
+    start = time.perf_counter()
+    offsets = list(segmenter.segment(texts, batchSize))
+    return offsets, time.perf_counter() - start
+
+# Function to compare the sentence boundaries of a backend with the reference, the end of every sentence but the last one is a boundary
+# Returns the precision, recall and F1 of the boundaries and the fraction of documents with the same boundaries
+def boundaryAgreement(offsets, referenceOffsets):
+    truePositives = predicted = expected = identical = 0
+    for docOffsets, docReference in zip(offsets, referenceOffsets):
+        boundaries = {end for _, end in docOffsets[:-1]}
+        referenceBoundaries = {end for _, end in docReference[:-1]}
+        truePositives += len(boundaries & referenceBoundaries)
+        predicted += len(boundaries)
+        expected += len(referenceBoundaries)
+        identical += boundaries == referenceBoundaries
+    precision = truePositives / predicted if predicted else 1.0
+    recall = truePositives / expected if expected else 1.0
+    f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+    return precision, recall, f1, identical / len(offsets) if offsets else 1.0
+
+# Function to build the chemical-disease pairs of the documents from their sentence offsets
+# Returns a set of (pmid, chemical span, disease span, pair type) for every document
+def pairsFromOffsets(docs, offsets):
+    segmenter = PrecomputedSegmenter({doc.text: docOffsets for doc, docOffsets in zip(docs, offsets)})
+    return [{(pair.pmid, pair.chemical.start, pair.chemical.end, pair.disease.start, pair.disease.end, pair.pairType) for pair in pairsInDoc}
+            for pairsInDoc in preprocessCDR1.iterInstances(docs, lazyContexts=True, segmenter=segmenter)]
+
+if __name__ == '__main__':
+    # Parse the options of the comparison
+    parser = argparse.ArgumentParser(description='Compare the speed of the segmentation backends and their agreement with a reference backend')
+    parser.add_argument('--input', default='./CDR_Data/CDR.Corpus.v010516/CDR_TestSet.PubTator.txt', help='PubTator file of the documents')
+    parser.add_argument('--segmenters', nargs='*', choices=list(SEGMENTERS), default=list(SEGMENTERS), help='Backends to compare')
+    parser.add_argument('--reference', choices=list(SEGMENTERS), default='scibert', help='Backend whose boundaries and pairs are taken as correct')
+    parser.add_argument('--batch-size', type=int, default=32, help='Number of documents sent to SpaCy at once')
+    args = parser.parse_args()
+
+    # Load the text and annotations of the documents, the relations are not needed to compare the pairs
+    docs = list(iterDocuments(args.input, TEXT_ANNOTATIONS))
+    texts = [doc.text for doc in docs]
+
+    # Segment the documents with every backend that can be loaded, the reference first
+    results = {}
+    for name in [args.reference] + [name for name in args.segmenters if name != args.reference]:
+        try:
+            segmenter = loadSegmenter(name)
+        except OSError as error:
+            print(f"{name}: skipped, the model could not be loaded ({error})")
+            continue
+        results[name] = timeSegmenter(segmenter, texts, args.batch_size)
+    if args.reference not in results:
+        raise SystemExit(f"the reference backend {args.reference} could not be loaded, choose another one with --reference")
+
+    referenceOffsets = results[args.reference][0]
+    referencePairs = pairsFromOffsets(docs, referenceOffsets)
+    print(f"{len(docs)} documents, reference {args.reference}")
+    print(f"{'segmenter':<16}{'docs/sec':>10}{'precision':>11}{'recall':>8}{'F1':>8}{'same docs':>11}{'same pairs':>12}{'same pair docs':>16}")
+    for name, (offsets, seconds) in results.items():
+        precision, recall, f1, identicalDocs = boundaryAgreement(offsets, referenceOffsets)
+        pairs = pairsFromOffsets(docs, offsets)
+        # Pairs with the same spans and the same pair type as the reference
+        samePairs = sum(len(docPairs & docReference) for docPairs, docReference in zip(pairs, referencePairs))
+        allPairs = sum(len(docPairs | docReference) for docPairs, docReference in zip(pairs, referencePairs))
+        samePairDocs = sum(docPairs == docReference for docPairs, docReference in zip(pairs, referencePairs))
+        print(f"{name:<16}{len(docs) / seconds:>10.1f}{precision:>11.4f}{recall:>8.4f}{f1:>8.4f}{identicalDocs:>11.2%}"
+              f"{samePairs / allPairs if allPairs else 1.0:>12.2%}{samePairDocs / len(docs):>16.2%}")
@@ -0,0 +1,55 @@
+import hashlib
+import os
+import sqlite3
+import numpy as np
+
+# Largest number of parameters sent in one query, older SQLite versions allow at most 999
+QUERY_SIZE = 900
+
+# Function to hash the text of a document
+def textHash(text):
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+# A persistent cache of the sentence offsets of documents in an SQLite file
+# An entry is keyed by the PubMed ID of the document, the hash of its text and the name and version of the segmentation model
+class SentenceCache:
+    def __init__(self, path):
+        self.path = path                                        # Path of the SQLite file
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.connection = sqlite3.connect(path, timeout=60)
+        # Several processes can read the cache while one of them writes to it
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS sentences (pmid TEXT, textHash TEXT, model TEXT, offsets BLOB, "
+                                "PRIMARY KEY (pmid, textHash, model))")
+        self.connection.commit()
+
+    # The connection is not pickled, a cache sent to another process opens the file again
+    def __getstate__(self):
+        return self.path
+
+    def __setstate__(self, path):
+        self.__init__(path)
+
+    # Returns the offsets of the (pmid, text hash) keys that are in the cache for the model, as a dictionary keyed by (pmid, text hash)
+    def getMany(self, keys, model):
+        keys = set(keys)
+        pmids = sorted({pmid for pmid, _ in keys})
+        found = {}
+        for start in range(0, len(pmids), QUERY_SIZE):
+            group = pmids[start:start + QUERY_SIZE]
+            rows = self.connection.execute(f"SELECT pmid, textHash, offsets FROM sentences WHERE model = ? AND pmid IN ({','.join('?' * len(group))})",
+                                           [model] + group)
+            for pmid, hashOfText, offsets in rows:
+                if (pmid, hashOfText) in keys:
+                    found[(pmid, hashOfText)] = [tuple(span) for span in np.frombuffer(offsets, dtype=np.int32).reshape(-1, 2).tolist()]
+        return found
+
+    # Stores the offsets of several documents in one transaction, entries is a list of (pmid, text hash, offsets)
+    def putMany(self, entries, model):
+        with self.connection:
+            self.connection.executemany("INSERT OR REPLACE INTO sentences VALUES (?, ?, ?, ?)",
+                                        [(pmid, hashOfText, model, np.array(offsets, dtype=np.int32).reshape(-1, 2).tobytes())
+                                         for pmid, hashOfText, offsets in entries])
+
+    def close(self):
+        self.connection.close()
@@ -0,0 +1,144 @@
+import itertools
+import re
+import spacy
+from sentenceCache import textHash
+
+# Name of the SpaCy model specialized in biomedical text that is used for sentence segmentation
+DEFAULT_MODEL = "en_core_sci_scibert"
+
+# Version of the rules applied to the sentences found by SpaCy, to be increased when sentenceOffsets changes
+SEGMENTATION_VERSION = 1
+
+# Pipeline components that take part in setting sentence boundaries, every other component is disabled
+SENTENCE_COMPONENTS = ("transformer", "tok2vec", "parser", "senter", "sentencizer")
+
+# Function to load a SpaCy pipeline that only runs the components needed for sentence boundaries
+def loadSentenceModel(modelName=DEFAULT_MODEL):
+    nlp = spacy.load(modelName)
+    for name in nlp.pipe_names:
+        if name not in SENTENCE_COMPONENTS:
+            nlp.disable_pipe(name)
+    return nlp
+
+# Function to compute the (start, end) character offsets of the sentences found in a processed text
+def sentenceOffsets(parsed):
+    offsets = []
+    for senText in parsed.sents:
+        # Skip the sentences consisting of a single character
+        if len(senText.text) <= 1:
+            continue
+        offsets.append((senText.start_char, senText.end_char))
+    return offsets
+
+# A segmenter that finds sentence boundaries with a SpaCy pipeline
+class SpacySegmenter:
+    def __init__(self, nlp):
+        self.nlp = nlp                                          # SpaCy pipeline with the sentence boundary components
+        # Name of the segmentation, the sentence offsets are cached under this name
+        self.version = f"{nlp.meta.get('lang')}_{nlp.meta.get('name')}-{nlp.meta.get('version')}/spacy-{spacy.__version__}/{SEGMENTATION_VERSION}"
+
+    # Yields the sentence offsets of every text in order
+    def segment(self, texts, batchSize=32, nProcess=1):
+        for parsed in self.nlp.pipe(texts, batch_size=batchSize, n_process=nProcess):
+            yield sentenceOffsets(parsed)
+
+# Words that end with a period without ending the sentence in PubMed abstracts
+ABBREVIATIONS = {
+    "al", "approx", "ca", "cf", "dr", "e.g", "eg", "etc", "fig", "figs", "i.e", "ie", "inc", "mr", "mrs", "ms", "no", "nos",
+    "prof", "ref", "refs", "resp", "sp", "spp", "st", "vol", "vs",
+}
+
+# Titles that come before the initials of a name
+TITLES = {"dr", "mr", "mrs", "ms", "prof"}
+
+# The initial of a name at the start of the next sentence, as in J. R. Smith
+NEXT_INITIAL = re.compile(r"[\"'(\[]?[A-Z]\.(?=\s|$)")
+
+# A period, question mark or exclamation mark followed by whitespace and the start of a sentence: a capital letter, a digit or an opening bracket or quote
+SENTENCE_END = re.compile(r"[.?!][\"')\]]*\s+(?=[\"'(\[]?[A-Z0-9])")
+
+# A segmenter that splits PubMed abstracts at sentence ending punctuation with rules for abbreviations and initials
+class RegexSegmenter:
+    version = "regex/2"                                         # Name of the segmentation, to be increased when the rules change
+
+    # Returns the sentence offsets of a text
+    def segmentText(self, text):
+        offsets = []
+        start = 0
+        for match in SENTENCE_END.finditer(text):
+            # Keep the sentence going after an abbreviation or the initial of a name
+            previousWords = text[start:match.start()].split()
+            previousWord = previousWords[-1].lstrip("([") if previousWords else ""
+            if text[match.start()] == "." and (previousWord.lower() in ABBREVIATIONS or self.isInitial(previousWords, text, match.end())):
+                continue
+            offsets.append((start, match.start() + len(match.group().rstrip())))
+            start = match.end()
+        offsets.append((start, len(text.rstrip())))
+
+        # Skip the sentences consisting of a single character, as for SpaCy
+        return [(start, end) for start, end in offsets if end - start > 1]
+
+    # Returns whether the last of the words before a period is the initial of a name
+    # A single capital letter is only an initial next to another initial or after a title, as in J. R. Smith or Dr. J. Smith,
+    # otherwise it ends the sentence, as in vitamin D. or hepatitis B.
+    def isInitial(self, previousWords, text, nextStart):
+        previousWord = previousWords[-1].lstrip("([") if previousWords else ""
+        if len(previousWord) != 1 or not previousWord.isupper():
+            return False
+        wordBefore = previousWords[-2].lstrip("([").rstrip(".").lower() if len(previousWords) > 1 else ""
+        initialBefore = len(previousWords) > 1 and NEXT_INITIAL.fullmatch(previousWords[-2]) is not None
+        return initialBefore or wordBefore in TITLES or NEXT_INITIAL.match(text, nextStart) is not None
+
+    # Yields the sentence offsets of every text in order
+    def segment(self, texts, batchSize=32, nProcess=1):
+        for text in texts:
+            yield self.segmentText(text)
+
+# Function to build a blank SpaCy pipeline with the rule-based sentencizer
+def loadSentencizer():
+    nlp = spacy.blank("en")
+    nlp.add_pipe("sentencizer")
+    return nlp
+
+# Segmentation backends that can be chosen by name, from the slowest and most accurate to the fastest
+SEGMENTERS = {
+    "scibert": lambda: SpacySegmenter(loadSentenceModel("en_core_sci_scibert")),
+    "scispacy-small": lambda: SpacySegmenter(loadSentenceModel("en_core_sci_sm")),
+    "sentencizer": lambda: SpacySegmenter(loadSentencizer()),
+    "regex": RegexSegmenter,
+}
+
+# Name of the backend used unless another one is chosen
+DEFAULT_SEGMENTER = "scibert"
+
+# Function to load a segmentation backend by name
+def loadSegmenter(name=DEFAULT_SEGMENTER):
+    if name not in SEGMENTERS:
+        raise ValueError(f"unknown segmenter {name}, the segmenters are {', '.join(SEGMENTERS)}")
+    return SEGMENTERS[name]()
+
+# Function to stream the documents through a segmenter in batches and yield each document with its sentence offsets
+# If a SentenceCache is given, the documents are looked up in chunks and only the documents that are not cached are segmented
+def segmentDocuments(docs, segmenter, batchSize=32, nProcess=1, cache=None, chunkSize=1024):
+    if cache is None:
+        docs, texts = itertools.tee(docs)
+        yield from zip(docs, segmenter.segment((doc.text for doc in texts), batchSize, nProcess))
+        return
+
+    docs = iter(docs)
+    while True:
+        chunk = list(itertools.islice(docs, chunkSize))
+        if not chunk:
+            return
+
+        keys = [(doc.pmid, textHash(doc.text)) for doc in chunk]
+        found = cache.getMany(keys, segmenter.version)
+        missing = [i for i, key in enumerate(keys) if key not in found]
+        if missing:
+            segmented = segmenter.segment([chunk[i].text for i in missing], batchSize, nProcess)
+            for i, offsets in zip(missing, segmented):
+                found[keys[i]] = offsets
+            cache.putMany([keys[i] + (found[keys[i]],) for i in missing], segmenter.version)
+
+        for doc, key in zip(chunk, keys):
+            yield doc, found[key]
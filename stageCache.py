@@ -0,0 +1,143 @@
+import hashlib
+import json
+import os
+import pickle
+from collections import deque
+
+# Version of the output of every stage, to be increased when the code of a stage changes its output
+STAGE_VERSIONS = {'pairs1': 2, 'pairs2': 1, 'input': 1}
+
+# Function to hash the parts of a key in a way that does not depend on the Python process
+def digest(*parts):
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, separators=(',', ':')).encode('utf-8')).hexdigest()
+
+# Function to compute the key of a document from its text, annotations and relations
+def documentKey(doc):
+    annotations = [(ann.pmid, ann.start, ann.end, ann.text, ann.type, ann.id) for ann in doc.annotations]
+    relations = [(rel.pmid, rel.type, rel.id1, rel.id2) for rel in doc.relations]
+    return digest('document', doc.pmid, doc.text, annotations, relations)
+
+# Function to compute the key of the output of a stage from the key of its input and the parameters and resources of the stage
+def chainKey(parentKey, stageName, params):
+    return digest(parentKey, stageName, STAGE_VERSIONS[stageName], params)
+
+fileDigests = {}                            # Digests of the resource files keyed by (path, size, modification time)
+
+# Function to compute the digest of the content of a file, it is only read again if it has changed
+def fileDigest(path):
+    stat = os.stat(path)
+    cacheKey = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    if cacheKey not in fileDigests:
+        fileHash = hashlib.sha256()
+        with open(path, 'rb') as inputFile:
+            for block in iter(lambda: inputFile.read(1 << 20), b''):
+                fileHash.update(block)
+        fileDigests[cacheKey] = fileHash.hexdigest()
+    return fileDigests[cacheKey]
+
+# A directory of stage outputs addressed by their keys, every entry is the output of one stage for one document
+class StageCache:
+    def __init__(self, directory):
+        self.directory = directory                              # Directory of the entries
+        self.hits = {}                                          # Number of reused entries of every stage
+        self.misses = {}                                        # Number of computed entries of every stage
+
+    def path(self, key):
+        return os.path.join(self.directory, key[:2], key + '.pkl')
+
+    # Returns (True, output) if the entry exists, (False, None) otherwise
+    def get(self, key):
+        try:
+            with open(self.path(key), 'rb') as inputFile:
+                return True, pickle.load(inputFile)
+        except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+            return False, None
+
+    # Returns whether an entry exists, without reading it
+    def contains(self, key):
+        return os.path.exists(self.path(key))
+
+    # Stores an entry, the file is replaced at once so that a reader never sees a partial entry
+    def put(self, key, output):
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temporaryFile = f"{path}.{os.getpid()}.tmp"
+        with open(temporaryFile, 'wb') as outputFile:
+            pickle.dump(output, outputFile)
+        os.replace(temporaryFile, path)
+
+    # Returns a line with the number of reused and computed documents of every stage
+    def summary(self):
+        return ", ".join(f"{stageName}: {self.hits.get(stageName, 0)} reused, {self.misses.get(stageName, 0)} computed"
+                         for stageName in STAGE_VERSIONS if stageName in self.hits or stageName in self.misses)
+
+# Function to apply a stage to a stream of (key, item) documents without a cache, the keys are passed on with the outputs
+# The stages yield one output for every document in order, so the keys of the documents read by the stage are kept in a queue
+def keyedStage(keyedStream, stage):
+    keys = deque()
+    def items():
+        for key, item in keyedStream:
+            keys.append(key)
+            yield item
+    for output in stage(items()):
+        yield keys.popleft(), output
+
+# Function to apply a stage to a stream of (key, item) documents, reusing the cached outputs of the documents whose key is known
+# The stage is started once for the whole stream and only receives the documents that are not in the cache, in their order,
+# so the resources and processes of the stage are set up once however many documents are missing
+# The stage may read far past the cached documents to find its next missing document, so a cached output is only read when it is yielded
+# Yields (key, output) for every document in order, the key is None if the key of the input is unknown
+def cachedStage(keyedStream, stage, cache, stageName, params):
+    if cache is None:
+        yield from keyedStage(keyedStream, stage)
+        return
+
+    keyedStream = iter(keyedStream)
+    pending = deque()                       # [key, ready, output, cached] of the documents that are read and not yielded yet, in order
+    waiting = deque()                       # Entries of pending whose output is computed by the stage, in order
+    missing = deque()                       # Documents that are not in the cache and that the stage has not read yet
+
+    # Reads the next document of the stream and looks it up in the cache, returns False at the end of the stream
+    def readDocument():
+        try:
+            key, item = next(keyedStream)
+        except StopIteration:
+            return False
+        key = chainKey(key, stageName, params) if key is not None else None
+        found = key is not None and cache.contains(key)
+        entry = [key, found, None, found]
+        pending.append(entry)
+        if found:
+            cache.hits[stageName] = cache.hits.get(stageName, 0) + 1
+        else:
+            cache.misses[stageName] = cache.misses.get(stageName, 0) + 1
+            waiting.append(entry)
+            missing.append(item)
+        return True
+
+    # Documents received by the stage, the stream is read as far as the stage reads ahead
+    def missingDocuments():
+        while missing or readDocument():
+            if missing:
+                yield missing.popleft()
+
+    outputs = iter(stage(missingDocuments()))
+    try:
+        while pending or readDocument():
+            if not pending[0][1]:
+                # The stage reads documents until it yields the output of the first missing document
+                entry = waiting.popleft()
+                entry[1], entry[2] = True, next(outputs)
+                if entry[0] is not None:
+                    cache.put(entry[0], entry[2])
+                continue
+            key, _, output, cached = pending.popleft()
+            if cached:
+                found, output = cache.get(key)
+                if not found:
+                    raise RuntimeError(f"the cache entry {cache.path(key)} of the {stageName} stage could not be read after it was found")
+            yield key, output
+    finally:
+        # Stop the stage, and the processes it started, if the stream is not read to the end
+        if hasattr(outputs, 'close'):
+            outputs.close()
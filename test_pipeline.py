@@ -0,0 +1,95 @@
+import pickle
+import string
+import numpy as np
+from transformers import BertTokenizerFast
+from pipeline import buildParser, mergeShards, outputPath, runPipeline, runShards
+from tokenizedStore import TokenizedShards
+
+# Chemicals mentioned in the documents of the test corpus with their ids
+CHEMICALS = {"aspirin": "CHEBI:15365", "caffeine": "CHEBI:27732", "glucose": "CHEBI:17234", "ethanol": "CHEBI:16236"}
+
+# Function to write a PubTator document whose abstract mentions pairs of chemicals, one pair per sentence
+def pubtatorDocument(pmid, pairs):
+    title = f"Study {pmid} of chemicals."
+    abstract = ""
+    annotations = []
+    for first, second in pairs:
+        for name in (first, second):
+            start = len(title) + 1 + len(abstract) + (abstract + f"{first} was given with {second}. ").index(name, len(abstract))
+            annotations.append(f"{pmid}\t{start}\t{start + len(name)}\t{name}\tChemMet\t{CHEMICALS[name]}")
+        abstract += f"{first} was given with {second}. "
+    relations = [f"{pmid}\tReact\t{CHEMICALS[first]}\t{CHEMICALS[second]}" for first, second in pairs[:1]]
+    return "\n".join([f"{pmid}|t|{title}", f"{pmid}|a|{abstract.strip()}"] + annotations + relations) + "\n\n"
+
+# Function to write a tokenizer with a small vocabulary of characters
+def saveTokenizer(directory):
+    vocabFile = directory / "vocab.txt"
+    characters = string.ascii_letters + string.digits + string.punctuation
+    vocabFile.write_text("\n".join(["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]"] + list(characters) + [f"##{c}" for c in characters]) + "\n")
+    BertTokenizerFast(vocab_file=str(vocabFile), do_lower_case=False).save_pretrained(str(directory))
+    return str(directory)
+
+# Function to read a stream of pickles
+def readPickles(path):
+    outputs = []
+    with open(path, 'rb') as inputFile:
+        while True:
+            try:
+                outputs.append(pickle.load(inputFile))
+            except EOFError:
+                return outputs
+
+# Function to turn the pickled batches into comparable values
+def batchValues(batches):
+    return [[value.tolist() if hasattr(value, 'tolist') else value for value in batch] for batch in batches]
+
+# Function to run the pipeline on a file, without shards or with numShards shards that are merged
+def run(tmp_path, inputFile, outputDir, numShards=None, options=()):
+    argv = ['--corpus', 'chr', '--input', str(inputFile), '--output-dir', str(tmp_path / outputDir), '--segmenter', 'regex',
+            '--no-sentence-cache', '--tokenizer', str(tmp_path / 'tokenizer'), '--checkpoint', 'pairs1'] + list(options)
+    if numShards is None:
+        args = buildParser().parse_args(argv)
+        runPipeline(args, outputPath(args))
+        return
+    runShards(buildParser().parse_args(argv + ['--num-shards', str(numShards)]))
+    mergeShards(buildParser().parse_args(argv + ['--num-shards', str(numShards), '--merge']))
+
+# The merged outputs of the shards hold the documents in the order of the file, which is not sorted by PubMed ID,
+# and a document with an empty text is skipped by the shards as it is by a run without shards
+def test_merged_shards_match_a_run_without_shards(tmp_path):
+    (tmp_path / 'tokenizer').mkdir()
+    saveTokenizer(tmp_path / 'tokenizer')
+    inputFile = tmp_path / 'corpus.pubtator'
+    inputFile.write_text(
+        pubtatorDocument("500", [("aspirin", "caffeine"), ("glucose", "ethanol")])
+        + pubtatorDocument("100", [("caffeine", "glucose")])
+        + "200|t|\n200|a|\n\n"
+        + pubtatorDocument("400", [("ethanol", "aspirin"), ("aspirin", "glucose"), ("caffeine", "ethanol")])
+        + pubtatorDocument("300", [("glucose", "aspirin")])
+    )
+
+    run(tmp_path, inputFile, 'single')
+    run(tmp_path, inputFile, 'sharded', numShards=2)
+    single = readPickles(tmp_path / 'single' / 'pairs1.stream.pkl')
+    assert [pairsInDoc[0].pmid for pairsInDoc in single] == ["500", "100", "400", "300"]
+    assert [repr(pairsInDoc) for pairsInDoc in readPickles(tmp_path / 'sharded' / 'pairs1.stream.pkl')] == [repr(pairsInDoc) for pairsInDoc in single]
+    assert batchValues(readPickles(tmp_path / 'sharded' / 'tokenizedInputs.pkl')) == batchValues(readPickles(tmp_path / 'single' / 'tokenizedInputs.pkl'))
+
+# The merged store has the documents in the order of the file and the shard layout of a run without shards
+def test_merged_store_has_the_layout_of_a_run_without_shards(tmp_path):
+    (tmp_path / 'tokenizer').mkdir()
+    saveTokenizer(tmp_path / 'tokenizer')
+    inputFile = tmp_path / 'corpus.pubtator'
+    inputFile.write_text("".join(pubtatorDocument(pmid, [("aspirin", "caffeine"), ("glucose", "ethanol")]) for pmid in ("30", "10", "50", "20", "40")))
+
+    for layout in ([], ['--dynamic-length']):
+        options = ['--format', 'shards', '--shard-size', '4'] + layout
+        run(tmp_path, inputFile, f'single{len(layout)}', options=options)
+        run(tmp_path, inputFile, f'sharded{len(layout)}', numShards=3, options=options)
+        single = TokenizedShards(str(tmp_path / f'single{len(layout)}' / 'tokenizedInputs'))
+        merged = TokenizedShards(str(tmp_path / f'sharded{len(layout)}' / 'tokenizedInputs'))
+        assert merged.inputStarts == single.inputStarts and merged.documentStarts == single.documentStarts
+        assert len(single.shardNames) > 1
+        for i in range(len(single)):
+            singleInput, mergedInput = single[i], merged[i]
+            assert np.array_equal(singleInput[0], mergedInput[0]) and singleInput[1:] == mergedInput[1:]
@@ -0,0 +1,17 @@
+from sentenceSegmentation import RegexSegmenter
+
+# Function to split a text into sentences with the regex segmenter
+def sentences(text):
+    return [text[start:end] for start, end in RegexSegmenter().segmentText(text)]
+
+# A single capital letter that ends a chemical or disease name ends the sentence
+def test_letter_at_the_end_of_a_name_ends_the_sentence():
+    text = "Effects of vitamin D. The patients with hepatitis B. Treatment (n = 5) was given."
+    assert sentences(text) == ["Effects of vitamin D.", "The patients with hepatitis B.", "Treatment (n = 5) was given."]
+    assert sentences("It activates protein kinase C. Caspase-3 was not activated.") == ["It activates protein kinase C.", "Caspase-3 was not activated."]
+
+# The initials of a name do not end the sentence
+def test_initials_of_a_name_do_not_end_the_sentence():
+    text = "As shown by J. R. Smith and M. K. Jones in 1990. The results were confirmed."
+    assert sentences(text) == ["As shown by J. R. Smith and M. K. Jones in 1990.", "The results were confirmed."]
+    assert sentences("Dr. J. Smith treated them. They recovered.") == ["Dr. J. Smith treated them.", "They recovered."]
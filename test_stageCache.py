@@ -0,0 +1,38 @@
+import itertools
+from stageCache import StageCache, cachedStage
+
+# A cache that counts the entries it reads
+class CountingCache(StageCache):
+    def __init__(self, directory):
+        super().__init__(directory)
+        self.reads = 0
+
+    def get(self, key):
+        self.reads += 1
+        return super().get(key)
+
+# A stage that reads its documents in batches, as nlp.pipe and the filtering pool do
+def batchedStage(items, batchSize=32):
+    items = iter(items)
+    while True:
+        batch = list(itertools.islice(items, batchSize))
+        if not batch:
+            return
+        yield from ([item * 10] for item in batch)
+
+# Only the changed documents go through the stage and the cached outputs are only read when they are yielded
+def test_cached_outputs_are_read_when_they_are_yielded(tmp_path):
+    cache = CountingCache(str(tmp_path))
+    documents = [(f"document{i}", i) for i in range(5000)]
+    assert [output for _, output in cachedStage(documents, batchedStage, cache, 'pairs1', {})] == [[i * 10] for i in range(5000)]
+    assert cache.reads == 0
+
+    cache = CountingCache(str(tmp_path))
+    documents[0] = ("changed", 0)
+    stream = cachedStage(documents, batchedStage, cache, 'pairs1', {})
+    assert next(stream)[1] == [0]
+    # The stage has read every document looking for more missing documents, but no cached output is loaded yet
+    assert cache.reads == 0
+    assert [output for _, output in stream] == [[i * 10] for i in range(1, 5000)]
+    assert cache.reads == 4999
+    assert cache.summary() == "pairs1: 4999 reused, 1 computed"
@@ -0,0 +1,20 @@
+import numpy as np
+from tripleExtraction import getAllSplitTriplets
+
+# Function to build n distinct triplets
+def triplets(n):
+    return np.arange(3 * n, dtype=np.int32).reshape(-1, 3)
+
+# The triplets of a small update go to the training set
+def test_small_update_is_trained_on():
+    for n in (1, 10):
+        train, validation, test = getAllSplitTriplets(triplets(n), remainderToTrain=True)
+        assert (len(train), len(validation), len(test)) == (n, 0, 0)
+        assert sorted(train[:, 0].tolist()) == triplets(n)[:, 0].tolist()
+
+# A full build keeps its split, with the rounding remainder in the test set
+def test_full_build_split_is_unchanged():
+    train, validation, test = getAllSplitTriplets(triplets(301580))
+    assert (len(train), len(validation), len(test)) == (300072, 1507, 1)
+    train, validation, test = getAllSplitTriplets(triplets(301580), remainderToTrain=True)
+    assert (len(train), len(validation), len(test)) == (300073, 1507, 0)
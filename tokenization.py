@@ -0,0 +1,147 @@
+import hashlib
+from collections import OrderedDict
+import numpy as np
+
+MAX_LENGTH = 512                            # Maximum number of tokens of an input sequence
+
+# Function to create the input sequence of an input with [CLS] and [SEP] tokens, a lazy context is built here
+def createInputSequence(input):
+    return f"[CLS] {input.query} [SEP] {input.context} [SEP]"
+
+# Function to find, for every sequence, the index of the first token whose offsets contain the character position, or -1 if there is none
+def findTokenIndices(charPositions, offsetMapping):
+    charPositions = np.asarray(charPositions)[:, None]
+    contains = (offsetMapping[:, :, 0] <= charPositions) & (charPositions <= offsetMapping[:, :, 1])
+    return np.where(contains.any(axis=1), contains.argmax(axis=1), -1)
+
+# Function to tokenize the input sequences of a list of inputs in one call to the fast tokenizer
+# Returns the input ids, attention masks and offset mappings as arrays with one row per input
+def encodeInputs(inputs, tokenizer, maxLength=MAX_LENGTH, padding='max_length'):
+    tokens = tokenizer(
+        [createInputSequence(input) for input in inputs],
+        max_length=maxLength,
+        truncation=True,
+        padding=padding,
+        return_offsets_mapping=True
+    )
+    # Convert the lists to arrays directly, which is faster than letting the tokenizer build the tensors
+    inputIds = np.array(tokens['input_ids'], dtype=np.int64)
+    attentionMasks = np.array(tokens['attention_mask'], dtype=np.int64)
+    offsetMapping = np.array(tokens['offset_mapping'], dtype=np.int64)
+    return inputIds, attentionMasks, offsetMapping
+
+# A cache of the tokens of the contexts, so that a context shared by many inputs is only tokenized once
+# The cache holds at most maxTokens tokens, the least recently used contexts are evicted first
+class ContextTokenCache:
+    def __init__(self, tokenizer, maxTokens=2000000):
+        self.tokenizer = tokenizer                              # Fast tokenizer used for the queries and the contexts
+        self.maxTokens = maxTokens                              # Maximum number of cached tokens
+        self.entries = OrderedDict()                            # (token ids, offsets) of the contexts keyed by the hash of the context
+        self.cachedTokens = 0                                   # Number of tokens in the cache
+        self.hits = 0                                           # Number of contexts found in the cache
+        self.misses = 0                                         # Number of contexts that were tokenized
+
+    # Tokenizes pieces of input sequences without adding special tokens, the pieces are cut to maxLength tokens
+    def tokenizePieces(self, pieces, maxLength):
+        tokens = self.tokenizer(pieces, add_special_tokens=False, max_length=maxLength, truncation=True, return_offsets_mapping=True)
+        return [(np.array(ids, dtype=np.int64), np.array(offsets, dtype=np.int64).reshape(-1, 2))
+                for ids, offsets in zip(tokens['input_ids'], tokens['offset_mapping'])]
+
+    # Returns the (token ids, offsets) of every context, the contexts that are not in the cache are tokenized in one call
+    def lookup(self, contexts, maxLength):
+        keys = [hashlib.blake2b(context.encode('utf-8'), digest_size=16).digest() for context in contexts]
+        missing = {}                                            # Contexts to tokenize keyed by their hash
+        for key, context in zip(keys, contexts):
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+            elif key in missing:
+                self.hits += 1
+            else:
+                missing[key] = context
+                self.misses += 1
+
+        found = {key: self.entries[key] for key in keys if key in self.entries}
+        # The context ends with the last [SEP] of the input sequence
+        for key, entry in zip(missing, self.tokenizePieces([f"{context} [SEP]" for context in missing.values()], maxLength)):
+            found[key] = entry
+            self.entries[key] = entry
+            self.cachedTokens += len(entry[0])
+        while self.cachedTokens > self.maxTokens and self.entries:
+            _, (ids, _) = self.entries.popitem(last=False)
+            self.cachedTokens -= len(ids)
+
+        return [found[key] for key in keys]
+
+    # Builds the same arrays as encodeInputs by joining the tokens of the queries with the cached tokens of the contexts
+    # The query and the context are separated by a space, so no token of the input sequence spans both
+    def encode(self, inputs, maxLength=MAX_LENGTH, padding='max_length'):
+        prefixes = [f"[CLS] {input.query} [SEP]" for input in inputs]
+        prefixTokens = self.tokenizePieces(prefixes, maxLength)
+        contextTokens = self.lookup([str(input.context) for input in inputs], maxLength)
+
+        # Keep the tokens that fit between the [CLS] and [SEP] tokens added by the tokenizer
+        sequences = []
+        for prefix, (prefixIds, prefixOffsets), (contextIds, contextOffsets) in zip(prefixes, prefixTokens, contextTokens):
+            ids = np.concatenate([prefixIds, contextIds])[:maxLength - 2]
+            offsets = np.concatenate([prefixOffsets, contextOffsets + len(prefix) + 1])[:maxLength - 2]
+            sequences.append((ids, offsets))
+
+        width = maxLength if padding == 'max_length' else max((len(ids) + 2 for ids, _ in sequences), default=0)
+        inputIds = np.full((len(inputs), width), self.tokenizer.pad_token_id, dtype=np.int64)
+        attentionMasks = np.zeros((len(inputs), width), dtype=np.int64)
+        # The added [CLS] and [SEP] tokens and the padding tokens have the offsets (0, 0)
+        offsetMapping = np.zeros((len(inputs), width, 2), dtype=np.int64)
+        for i, (ids, offsets) in enumerate(sequences):
+            inputIds[i, 0] = self.tokenizer.cls_token_id
+            inputIds[i, 1:len(ids) + 1] = ids
+            inputIds[i, len(ids) + 1] = self.tokenizer.sep_token_id
+            attentionMasks[i, :len(ids) + 2] = 1
+            offsetMapping[i, 1:len(ids) + 1] = offsets
+        return inputIds, attentionMasks, offsetMapping
+
+# Function to tokenize a list of inputs and find the token indices of their ground truth spans
+# Returns the input ids, attention masks and the token indices of the ground truth spans as arrays with one row per input
+# The rows are padded to maxLength, or to the longest sequence of the inputs if padding is 'longest'
+# If a ContextTokenCache is given, the contexts are tokenized through the cache
+def tokenizeInputs(inputs, tokenizer, maxLength=MAX_LENGTH, padding='max_length', cache=None):
+    if cache is not None:
+        inputIds, attentionMasks, offsetMapping = cache.encode(inputs, maxLength, padding)
+    else:
+        inputIds, attentionMasks, offsetMapping = encodeInputs(inputs, tokenizer, maxLength, padding)
+    # The padding tokens have the same offsets (0, 0) as the [CLS] token before them, so the padding does not change the token indices
+    startTokenIndices = findTokenIndices([input.groundTruthStart for input in inputs], offsetMapping)
+    endTokenIndices = findTokenIndices([input.groundTruthEnd for input in inputs], offsetMapping)
+
+    return inputIds, attentionMasks, startTokenIndices, endTokenIndices
+
+# Function to tokenize the inputs of many documents in batches that cross document boundaries
+# Yields (inputsInDoc, inputIds, attentionMasks, startTokenIndices, endTokenIndices) for every document in order
+def tokenizeDocuments(docsInputs, tokenizer, batchSize=1024, maxLength=MAX_LENGTH, padding='max_length', cache=None):
+    pendingDocs = []                        # Documents waiting to be tokenized
+    pendingCount = 0                        # Number of inputs in the waiting documents
+
+    for inputsInDoc in docsInputs:
+        pendingDocs.append(inputsInDoc)
+        pendingCount += len(inputsInDoc)
+        if pendingCount >= batchSize:
+            yield from tokenizeBatch(pendingDocs, tokenizer, maxLength, padding, cache)
+            pendingDocs = []
+            pendingCount = 0
+
+    if pendingDocs:
+        yield from tokenizeBatch(pendingDocs, tokenizer, maxLength, padding, cache)
+
+# Function to tokenize the inputs of several documents at once and split the results back into documents
+def tokenizeBatch(docsInputs, tokenizer, maxLength=MAX_LENGTH, padding='max_length', cache=None):
+    inputs = [input for inputsInDoc in docsInputs for input in inputsInDoc]
+    if inputs:
+        arrays = tokenizeInputs(inputs, tokenizer, maxLength, padding, cache)
+    else:
+        arrays = (np.zeros((0, maxLength), dtype=np.int64), np.zeros((0, maxLength), dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64))
+
+    start = 0
+    for inputsInDoc in docsInputs:
+        end = start + len(inputsInDoc)
+        yield (inputsInDoc,) + tuple(array[start:end] for array in arrays)
+        start = end
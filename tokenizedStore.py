@@ -0,0 +1,261 @@
+import bisect
+import json
+import os
+import numpy as np
+import torch
+from torch.utils.data import Dataset
+
+STORE_FORMAT = "tokenizedShards"            # Name of the format written in the manifest
+STORE_VERSION = 1                           # Version of the shard layout
+MANIFEST_FILE = "manifest.json"             # Name of the manifest in the store directory
+# Arrays stored for every shard of each layout, one .npy file each
+# In the fixed layout the token ids are rows of maxLength tokens, in the ragged layout they are the unpadded sequences one after another
+SHARD_ARRAYS = {
+    "fixed": ("inputIds", "lengths", "labels", "entityIds", "documentOffsets"),
+    "ragged": ("inputIds", "tokenOffsets", "lengths", "labels", "entityIds", "documentOffsets"),
+}
+
+# Function to choose the smallest integer type that holds every token id of the tokenizer
+def tokenDtype(vocabSize):
+    return np.uint16 if vocabSize <= np.iinfo(np.uint16).max + 1 else np.int32
+
+# Function to read the manifest of a store
+def readManifest(directory):
+    with open(os.path.join(directory, MANIFEST_FILE)) as inputFile:
+        manifest = json.load(inputFile)
+    if manifest.get("format") != STORE_FORMAT or manifest.get("version") != STORE_VERSION:
+        raise ValueError(f"{directory} is not a tokenized store of version {STORE_VERSION}")
+    return manifest
+
+# Function to write the manifest of a store, the manifest is replaced at once so that a reader never sees a partial store
+def writeManifest(directory, manifest):
+    temporaryFile = os.path.join(directory, MANIFEST_FILE + '.tmp')
+    with open(temporaryFile, 'w') as outputFile:
+        json.dump(manifest, outputFile)
+    os.replace(temporaryFile, os.path.join(directory, MANIFEST_FILE))
+
+# Function to build the path of an array of a shard
+def shardArrayPath(directory, shardName, arrayName):
+    return os.path.join(directory, f"{shardName}-{arrayName}.npy")
+
+# A class that writes tokenized documents to a directory of shards
+# Every shard holds whole documents: the token ids, the number of tokens of every input, the ground truth token indices,
+# the entity ids as positions in a string table and the offsets of the documents in the inputs of the shard
+class TokenizedShardWriter:
+    def __init__(self, directory, vocabSize, maxLength, shardSize=65536, ragged=False, padTokenId=0):
+        self.directory = directory                              # Directory of the store
+        self.dtype = tokenDtype(vocabSize)                      # Type of the stored token ids
+        self.maxLength = maxLength                              # Maximum number of tokens of an input
+        self.shardSize = shardSize                              # Number of inputs after which a shard is closed
+        self.layout = "ragged" if ragged else "fixed"           # Whether the token ids are stored without padding
+        self.padTokenId = padTokenId                            # Token id used to pad the sequences when they are read
+        self.shards = []                                        # Manifest entries of the written shards
+        self.resetShard()
+        os.makedirs(directory, exist_ok=True)
+
+    def resetShard(self):
+        self.inputIds = []                                      # Token id arrays of the documents of the open shard
+        self.lengths = []                                       # Token counts of the documents of the open shard
+        self.labels = []                                        # Ground truth token indices of the documents of the open shard
+        self.entityIds = []                                     # Entity id positions of the inputs of the open shard
+        self.idTable = {}                                       # Position of every entity id in the string table of the open shard
+        self.documentOffsets = [0]                              # Offsets of the documents in the rows of the open shard
+
+    # Adds the tokenized inputs of a document, entityIds holds an (id, id) pair for every input
+    # The rows of inputIds may be padded to any width, in the fixed layout they are padded to maxLength
+    def addDocument(self, inputIds, attentionMasks, startTokenIndices, endTokenIndices, entityIds):
+        inputIds = np.asarray(inputIds)
+        # The sequences are padded on the right, so the attention mask is given by the number of tokens
+        lengths = np.asarray(attentionMasks).sum(axis=1).astype(np.int32)
+        if self.layout == "ragged":
+            # Keep the tokens of every row up to its length, one row after another
+            inputIds = inputIds[np.arange(inputIds.shape[1]) < lengths[:, None]]
+        elif inputIds.shape[1] != self.maxLength:
+            raise ValueError(f"the fixed layout needs rows of {self.maxLength} tokens, got {inputIds.shape[1]}")
+        self.inputIds.append(inputIds.astype(self.dtype))
+        self.lengths.append(lengths)
+        self.labels.append(np.stack([startTokenIndices, endTokenIndices], axis=1).astype(np.int32).reshape(-1, 2))
+        self.entityIds.extend([self.idTable.setdefault(id, len(self.idTable)) for id in pair] for pair in entityIds)
+        self.documentOffsets.append(self.documentOffsets[-1] + len(lengths))
+        if self.documentOffsets[-1] >= self.shardSize:
+            self.flushShard()
+
+    def flushShard(self):
+        if len(self.documentOffsets) == 1:
+            return
+        shardName = f"shard-{len(self.shards):05d}"
+        lengths = np.concatenate(self.lengths)
+        arrays = {
+            "inputIds": np.concatenate(self.inputIds),
+            "lengths": lengths,
+            "labels": np.concatenate(self.labels),
+            "entityIds": np.array(self.entityIds, dtype=np.int32).reshape(-1, 2),
+            "documentOffsets": np.array(self.documentOffsets, dtype=np.int64),
+        }
+        if self.layout == "ragged":
+            arrays["tokenOffsets"] = np.concatenate([[0], np.cumsum(lengths, dtype=np.int64)])
+        for arrayName, array in arrays.items():
+            np.save(shardArrayPath(self.directory, shardName, arrayName), array)
+        self.shards.append({
+            "name": shardName,
+            "documents": len(self.documentOffsets) - 1,
+            "inputs": self.documentOffsets[-1],
+            "ids": list(self.idTable),
+        })
+        self.resetShard()
+
+    # Writes the open shard and the manifest, the store can only be read after it is closed
+    def close(self):
+        self.flushShard()
+        manifest = {
+            "format": STORE_FORMAT,
+            "version": STORE_VERSION,
+            "layout": self.layout,
+            "maxLength": self.maxLength,
+            "tokenDtype": np.dtype(self.dtype).name,
+            "padTokenId": self.padTokenId,
+            "shards": self.shards,
+        }
+        writeManifest(self.directory, manifest)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        if excType is None:
+            self.close()
+
+# Function to combine several stores into one store, the stores must have the same layout and token type
+# order gives the (store, document) pairs in the order of the merged store, by default the documents keep the order of the stores
+# The documents are copied one by one, so the merged store is cut into shards of shardSize inputs as if it was written at once
+def mergeStores(directories, outputDirectory, order=None, shardSize=65536):
+    manifests = [readManifest(directory) for directory in directories]
+    merged = {key: value for key, value in manifests[0].items() if key != "shards"}
+    for directory, manifest in zip(directories, manifests):
+        if {key: value for key, value in manifest.items() if key != "shards"} != merged:
+            raise ValueError(f"{directory} does not have the same layout as {directories[0]}")
+    stores = [TokenizedShards(directory) for directory in directories]
+    if order is None:
+        order = [(store, document) for store in range(len(stores)) for document in range(stores[store].numDocuments())]
+
+    # The largest vocabulary that is stored with the token type of the stores
+    vocabSize = np.iinfo(merged["tokenDtype"]).max + 1
+    with TokenizedShardWriter(outputDirectory, vocabSize, merged["maxLength"], shardSize, ragged=merged["layout"] == "ragged", padTokenId=merged["padTokenId"]) as writer:
+        for store, document in order:
+            writer.addDocument(*stores[store].documentArrays(document))
+
+# Random access to the inputs of a store written by TokenizedShardWriter
+# The shards are memory-mapped on first use, so a reader sent to a DataLoader worker maps them in the worker
+class TokenizedShards:
+    def __init__(self, directory):
+        self.directory = directory
+        manifest = readManifest(directory)
+        self.layout = manifest["layout"]
+        self.maxLength = manifest["maxLength"]
+        self.padTokenId = manifest["padTokenId"]
+        self.shardNames = [shard["name"] for shard in manifest["shards"]]
+        self.idTables = [shard["ids"] for shard in manifest["shards"]]
+        # First global input and document index of every shard
+        self.inputStarts = np.concatenate([[0], np.cumsum([shard["inputs"] for shard in manifest["shards"]])]).tolist()
+        self.documentStarts = np.concatenate([[0], np.cumsum([shard["documents"] for shard in manifest["shards"]])]).tolist()
+        self.arrays = [None] * len(self.shardNames)               # Memory-mapped arrays of the shards that are opened
+
+    # The memory maps are not pickled, every process opens its own
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['arrays'] = [None] * len(self.shardNames)
+        return state
+
+    def shardArrays(self, shard):
+        if self.arrays[shard] is None:
+            self.arrays[shard] = {arrayName: np.load(shardArrayPath(self.directory, self.shardNames[shard], arrayName), mmap_mode='r')
+                                  for arrayName in SHARD_ARRAYS[self.layout]}
+        return self.arrays[shard]
+
+    def __len__(self):
+        return self.inputStarts[-1]
+
+    def numDocuments(self):
+        return self.documentStarts[-1]
+
+    # Returns the number of tokens of every input of the store
+    def lengths(self):
+        if not len(self):
+            return np.zeros(0, dtype=np.int32)
+        return np.concatenate([self.shardArrays(shard)["lengths"] for shard in range(len(self.shardNames))])
+
+    # Returns the range of the global input indices of a document
+    def documentRange(self, document):
+        if not 0 <= document < self.numDocuments():
+            raise IndexError(document)
+        shard = bisect.bisect_right(self.documentStarts, document) - 1
+        offsets = self.shardArrays(shard)["documentOffsets"]
+        local = document - self.documentStarts[shard]
+        return range(self.inputStarts[shard] + int(offsets[local]), self.inputStarts[shard] + int(offsets[local + 1]))
+
+    # Returns the arrays of a document as they are passed to TokenizedShardWriter.addDocument
+    # The token ids are padded to maxLength in the fixed layout and to the longest input of the document in the ragged layout
+    def documentArrays(self, document):
+        rows = self.documentRange(document)
+        shard = bisect.bisect_right(self.documentStarts, document) - 1
+        arrays = self.shardArrays(shard)
+        first, last = rows.start - self.inputStarts[shard], rows.stop - self.inputStarts[shard]
+        lengths = np.asarray(arrays["lengths"][first:last])
+        if self.layout == "ragged":
+            inputIds = np.full((len(lengths), lengths.max(initial=0)), self.padTokenId, dtype=arrays["inputIds"].dtype)
+            for row, (start, end) in enumerate(zip(arrays["tokenOffsets"][first:last], arrays["tokenOffsets"][first + 1:last + 1])):
+                inputIds[row, :end - start] = arrays["inputIds"][start:end]
+        else:
+            inputIds = np.asarray(arrays["inputIds"][first:last])
+        attentionMasks = (np.arange(inputIds.shape[1]) < lengths[:, None]).astype(np.int64)
+        labels = np.asarray(arrays["labels"][first:last])
+        ids = self.idTables[shard]
+        entityIds = [(ids[firstID], ids[secondID]) for firstID, secondID in arrays["entityIds"][first:last].tolist()]
+        return inputIds, attentionMasks, labels[:, 0], labels[:, 1], entityIds
+
+    # Returns (inputIds, length, startTokenIndex, endTokenIndex, id, id) of an input, the token ids are a view of the shard
+    # The token ids are padded to maxLength in the fixed layout and hold only the tokens of the input in the ragged layout
+    def __getitem__(self, idx):
+        if not 0 <= idx < len(self):
+            raise IndexError(idx)
+        shard = bisect.bisect_right(self.inputStarts, idx) - 1
+        arrays = self.shardArrays(shard)
+        row = idx - self.inputStarts[shard]
+        ids = self.idTables[shard]
+        firstID, secondID = arrays["entityIds"][row]
+        startTokenIndex, endTokenIndex = arrays["labels"][row]
+        if self.layout == "ragged":
+            inputIds = arrays["inputIds"][arrays["tokenOffsets"][row]:arrays["tokenOffsets"][row + 1]]
+        else:
+            inputIds = arrays["inputIds"][row]
+        return inputIds, int(arrays["lengths"][row]), int(startTokenIndex), int(endTokenIndex), ids[firstID], ids[secondID]
+
+# Dataset over a tokenized store that returns the same tuples as the tokenized pickles
+# In the ragged layout the sequences are not padded, they can be batched with collateDynamic from lengthBatching.py
+class TokenizedShardDataset(Dataset):
+    def __init__(self, directory):
+        self.shards = TokenizedShards(directory)                # Reader of the store
+
+    def __len__(self):
+        return len(self.shards)
+
+    # Returns the indices of the inputs of a document, to be used with a Subset or a sampler
+    def documentIndices(self, document):
+        return self.shards.documentRange(document)
+
+    # Returns the number of tokens of every input, to be used with a LengthBucketBatchSampler
+    def lengths(self):
+        return self.shards.lengths()
+
+    def __getitem__(self, idx):
+        inputIds, length, startTokenIndex, endTokenIndex, firstID, secondID = self.shards[idx]
+        attentionMask = torch.zeros(len(inputIds), dtype=torch.long)
+        attentionMask[:length] = 1
+        return (
+            torch.from_numpy(inputIds.astype(np.int64)),        # Input IDs
+            attentionMask,                                      # Attention mask
+            firstID,                                            # Chemical ID
+            secondID,                                           # Disease ID or Chemical 2 ID
+            torch.tensor(startTokenIndex),                      # Ground truth start token index
+            torch.tensor(endTokenIndex)                         # Ground truth end token index
+        )
@@ -1,119 +1,166 @@
-from bioc import pubtator
-import xml.etree.ElementTree as ET
+import argparse
+import hashlib
+import itertools
+from ctdIngestion import ThrottledProgress, iterCTDRows
+from kgBundle import TRIPLET_SETS, KnowledgeGraphBundle, exportText, loadVocabularyStrings, writeBundle
+from pubtatorReader import RELATIONS, iterDocuments
+from tripletAccumulator import TripletAccumulator, Vocabulary, packColumns, unpackColumns
 import spacy
-import pickle
 import numpy as np
 from sklearn.model_selection import train_test_split
 
-# Function to extract entities, relations, and triplets from the CTD XML file
-def getTripletsFromCTD(xml_path):
-    entities = set()                        # Set to store unique entities (chemicals and diseases)
-    relations = set()                       # Set to store unique relations
-    triplets = {}                           # Dictionary to store triplets in the format (chemical, disease, pmid): [relation]
-    
-    # Parse the CTD XML file and extract information
-    for _, elem in ET.iterparse(xml_path, events=('end',)):
-        if elem.tag == 'Row':
-            chemical = elem.find('ChemicalID').text
-            disease = elem.find('DiseaseID').text.split(':')[1] if elem.find('DiseaseID') is not None else 'NIL'
-            pmids = elem.find('PubMedIDs').text if elem.find('PubMedIDs') is not None else 'NIL'
-            
-            relation = 'NIL'
-            directEvidence = elem.find('DirectEvidence')
-            inferenceScore = elem.find('InferenceScore')
-            # Determine the relation based on direct evidence or inference score
-            if directEvidence is not None:
-                if directEvidence.text == "therapeutic":
-                    relation = 'THR'
-                elif directEvidence.text == "marker/mechanism":
-                    relation = 'CID'
-            if inferenceScore is not None and inferenceScore.text:
-                relation = 'INF'
-
-            entities.add(chemical)
-            entities.add(disease)
-            relations.add(relation)
-
-            # Adding to relations array since we may have more than relation
-            if pmids != 'NIL':
-                pmidsSplitted = pmids.split('|')
-                for pmid in pmidsSplitted:
-                    key = (chemical, disease, pmid)
-                    triplets.setdefault(key, []).append(relation)
-                    print("Extracted CTD " + str(key))
-            else:
-                key = (chemical, disease, 'NIL')
-                triplets.setdefault(key, []).append(relation)
-                print("Extracted CTD " + str(key))
-            elem.clear()
-
-    return entities, relations, triplets
-
-# Function to extract entities, relations, and triplets from the CDR dataset
-def getTripletsFromCDR(docs, tripletsCTD):
-    entities = set()                        # Set to store unique entities (chemicals and diseases)
-    relations = set()                       # Set to store unique relations
-    triplets = {}                           # Dictionary to store triplets in the format (id1, id2, pmid): [relation]
-    
+# Relations of the knowledge graph, a new vocabulary starts with them so that their IDs are the same as the sorted relations of earlier builds
+KNOWN_RELATIONS = ('CID', 'INF', 'NIL', 'THR')
+
+# Function to hash the parts of a CTD row or CDR document into a signed 64-bit integer that does not depend on the Python process
+def stableHash(*parts):
+    return int.from_bytes(hashlib.blake2b(repr(parts).encode('utf-8'), digest_size=8).digest(), 'little', signed=True)
+
+# Function to hash the relations of a CDR document
+def documentHash(doc):
+    return stableHash(doc.pmid, sorted((relation.type, relation.id1, relation.id2, relation.pmid) for relation in doc.relations))
+
+# Function to find which values are in a sorted array
+def sortedContains(sortedArray, values):
+    values = np.asarray(values, dtype=np.int64)
+    if sortedArray is None or not len(sortedArray):
+        return np.zeros(len(values), dtype=bool)
+    positions = np.minimum(np.searchsorted(sortedArray, values), len(sortedArray) - 1)
+    return np.asarray(sortedArray)[positions] == values
+
+# Function to extract the triplets from the CTD chemical-disease file (XML, TSV or CSV, optionally gzipped) and hash its rows
+# Rows whose hash is in knownRows were ingested by an earlier build and are not added again, only their (chemical, disease, pmid) keys
+# that are in watchedKeys are collected
+# Returns the triplets of the new or changed rows, the sorted hashes of all the rows and the watched keys of the known rows
+def ingestCTD(path, workers=1, triplets=None, knownRows=None, watchedKeys=None, batchSize=65536):
+    triplets = triplets if triplets is not None else TripletAccumulator()
+    rowHashes = []                          # Hashes of the rows of every batch
+    matchedKeys = set()                     # Watched keys of the known rows
+    progress = ThrottledProgress("Extracted CTD rows")
+
+    # Stream the rows of the CTD file, the chunks of the file are parsed in worker processes if requested
+    rows = iterCTDRows(path, workers, progress=progress)
+    while True:
+        batch = list(itertools.islice(rows, batchSize))
+        if not batch:
+            break
+        hashes = np.array([stableHash(*row) for row in batch], dtype=np.int64)
+        rowHashes.append(hashes)
+        for (chemical, disease, relation, pmids), known in zip(batch, sortedContains(knownRows, hashes).tolist()):
+            if not known:
+                # Adding one triplet for every PubMed article since we may have more than relation
+                triplets.add(chemical, relation, disease, pmids)
+            elif watchedKeys:
+                matchedKeys.update(key for key in ((chemical, disease, pmid) for pmid in pmids) if key in watchedKeys)
+    progress.close()
+
+    # Rows repeating a (chemical, relation, disease, pmid) triplet are only kept once
+    triplets.deduplicate()
+    return triplets, np.unique(np.concatenate(rowHashes)) if rowHashes else np.zeros(0, dtype=np.int64), matchedKeys
+
+# Function to extract the triplets from the CTD chemical-disease file (XML, TSV or CSV, optionally gzipped)
+# The triplets are kept as integer codes in a TripletAccumulator, the vocabularies of the accumulator hold the entities and relations
+def getTripletsFromCTD(path, workers=1, triplets=None):
+    return ingestCTD(path, workers, triplets)[0]
+
+# Function to extract the triplets from the CDR dataset with the vocabularies of the CTD triplets and hash its documents
+# The relation of a CDR triplet is kept if CTD has a triplet with the same (chemical, disease, pmid), otherwise it is 'NIL'
+# The CTD keys are looked up in tripletsCTD and in matchedKeys, the keys of the CTD rows that are not in tripletsCTD
+# A document whose hash is in knownDocuments is only extracted again if tripletsCTD has one of its keys
+# Returns the triplets and the sorted hashes of all the documents
+def ingestCDR(docs, tripletsCTD, knownDocuments=None, matchedKeys=frozenset()):
+    triplets = tripletsCTD.sibling()
+    documentHashes = []
+    heads, tails, pmids, types, documents = [], [], [], [], []
+
     # Parse the documents to extract triplet information
     for doc in docs:
+        documentHashes.append(documentHash(doc))
         for triplet in doc.relations:
-            key = (triplet.id1, triplet.id2, triplet.pmid)
-            entities.add(triplet.id1)
-            entities.add(triplet.id2)
-            # Adding to relations array since we may have more than relation
-            if key in tripletsCTD:
-                triplets.setdefault(key, []).append(triplet.type)
-                relations.add(triplet.type)
-            # Store the relation as 'NIL' if it is not in tripletsCTD
-            else:
-                triplets[key] = ['NIL']
-                relations.add('NIL')
-            print("Extracted CDR " + str(key))
-    return entities, relations, triplets
+            heads.append(triplets.entities.encode(triplet.id1))
+            tails.append(triplets.entities.encode(triplet.id2))
+            pmids.append(triplets.pmids.encode(triplet.pmid))
+            types.append(triplet.type)
+            documents.append(len(documentHashes) - 1)
+
+    # Look up the (chemical, disease, pmid) keys of all the CDR triplets in the CTD triplets at once
+    inCTD = tripletsCTD.containsKeys(np.array(heads, dtype=np.int32), np.array(tails, dtype=np.int32), np.array(pmids, dtype=np.int32))
+    changed = ~sortedContains(knownDocuments, documentHashes)
+    changed[np.array(documents, dtype=np.int64)[inCTD]] = True
+    for head, tail, pmid, relation, found, document in zip(heads, tails, pmids, types, inCTD.tolist(), documents):
+        if changed[document]:
+            found = found or (triplets.entities.strings[head], triplets.entities.strings[tail], triplets.pmids.strings[pmid]) in matchedKeys
+            triplets.addCodes(head, relation if found else 'NIL', tail, pmid)
+    print(f"Extracted CDR triplets: {len(triplets)} done.")
+
+    triplets.deduplicate()
+    return triplets, np.unique(np.array(documentHashes, dtype=np.int64))
+
+# Function to extract the triplets from the CDR dataset, with the vocabularies of the CTD triplets
+# The relation of a CDR triplet is kept if CTD has a triplet with the same (chemical, disease, pmid), otherwise it is 'NIL'
+def getTripletsFromCDR(docs, tripletsCTD):
+    return ingestCDR(docs, tripletsCTD)[0]
+
+# Sources of a triplet, a triplet found in both datasets has both flags
+SOURCE_CDR = 1
+SOURCE_CTD = 2
+
+# Function to map the (head, relation, tail) codes of the triplets to their numerical IDs at once
+# Every vocabulary is turned into a lookup array of IDs that is indexed by the codes
+def tripletIDs(triplets, entityToID, relationToID):
+    heads, relations, tails, _ = triplets.columns()
+    entityIDs = np.array([entityToID[entity] for entity in triplets.entities.strings], dtype=np.int64)
+    relationIDs = np.array([relationToID[relation] for relation in triplets.relations.strings], dtype=np.int64)
+    return entityIDs[heads], relationIDs[relations], entityIDs[tails]
+
+# Function to find the unique (entity1, relation, entity2) triplets of ID columns and combine the source flags of the repeated triplets
+# The triplets are deduplicated on packed int64 keys, the result is sorted by (entity1, relation, entity2)
+def uniqueTriplets(columns, sources, numEntities, numRelations):
+    sizes = (numEntities, numRelations, numEntities)
+    keys = packColumns(columns, sizes)
+    if keys is not None:
+        uniqueKeys, inverse = np.unique(keys, return_inverse=True)
+        result = np.stack(unpackColumns(uniqueKeys, sizes), axis=1)
+    else:
+        result, inverse = np.unique(np.stack(columns, axis=1), axis=0, return_inverse=True)
+    resultSources = np.zeros(len(result), dtype=np.int8)
+    np.bitwise_or.at(resultSources, inverse.reshape(-1), sources)
+    return result, resultSources
+
+# Function to combine the CDR and CTD triplets and find the unique triplets of both datasets and of each dataset in one pass
+# Returns the arrays of the triplets of both datasets, of the CTD dataset and of the CDR dataset
+def getTripletSets(tripletsCDR, tripletsCTD, entityToID, relationToID):
+    # The IDs are changed from codes to numerical IDs here, every triplet is flagged with its source
+    columns = [np.concatenate(pair) for pair in zip(tripletIDs(tripletsCDR, entityToID, relationToID), tripletIDs(tripletsCTD, entityToID, relationToID))]
+    sources = np.concatenate((np.full(len(tripletsCDR), SOURCE_CDR, dtype=np.int8), np.full(len(tripletsCTD), SOURCE_CTD, dtype=np.int8)))
+    result, resultSources = uniqueTriplets(columns, sources, len(entityToID), len(relationToID))
+
+    tripletSets = (result, result[(resultSources & SOURCE_CTD) != 0], result[(resultSources & SOURCE_CDR) != 0])
+    for triplets in tripletSets:
+        print(f"Total Triplets: {len(triplets)}")
+    return tripletSets
 
 # Function to combine and process all triplets from the CDR and CTD datasets
 def getAllTriplets(tripletsCDR, tripletsCTD, entityToID, relationToID):
-    result = set()                          # Set to store unique triplets in the format (entity1, relation, entity2)
-
-    # Process the triplets from the CDR dataset
-    for key in tripletsCDR:
-        for rel in tripletsCDR[key]:
-            # The IDs are changed from strings to numerical IDs here
-            result.add((entityToID[key[0]], relationToID[rel], entityToID[key[1]]))
-
-    # Process the triplets from the CTD dataset
-    for key in tripletsCTD:
-        for rel in tripletsCTD[key]:
-            # The IDs are changed from strings to numerical IDs here
-            result.add((entityToID[key[0]], relationToID[rel], entityToID[key[1]]))
-    
-    resultList = list(result)
-    resultArray = np.array(resultList)
-
-    print(f"Total Triplets: {len(result)}")
-    return resultArray
+    return getTripletSets(tripletsCDR, tripletsCTD, entityToID, relationToID)[0]
 
 # Function to extract and process the final set of triplets for separate CDR and CTD sets
 def getFinaltriplets(triplets, entityToID, relationToID):
-    result = set()                          # Set to store unique triplets in the format (entity1, relation, entity2)
-
-    # Process the input triplets
-    for key in triplets:
-        for rel in triplets[key]:
-            # The IDs are changed from strings to numerical IDs here
-            result.add((entityToID[key[0]], relationToID[rel], entityToID[key[1]]))
-    
-    resultList = list(result)
-    resultArray = np.array(resultList)
+    result, _ = uniqueTriplets(tripletIDs(triplets, entityToID, relationToID), np.zeros(len(triplets), dtype=np.int8), len(entityToID), len(relationToID))
 
     print(f"Total Triplets: {len(result)}")
-    return resultArray
+    return result
 
 # Function to split the triplets into training, validation, and test sets
-def getAllSplitTriplets(finalTripletsAll, trainRatio=0.995, validationRatio=0.005):
+# The unique triplets are sorted by their IDs, so they are shuffled with a fixed seed before the split
+# The triplets left over by the rounding of the shares go to the test set, or to the training set with remainderToTrain,
+# so that the few triplets of a small update are trained on instead of all landing in the test set
+def getAllSplitTriplets(finalTripletsAll, trainRatio=0.995, validationRatio=0.005, seed=0, remainderToTrain=False):
+    finalTripletsAll = np.asarray(finalTripletsAll)[np.random.default_rng(seed).permutation(len(finalTripletsAll))]
     totalLines = len(finalTripletsAll)
     trainEnd = int(totalLines * trainRatio)
+    if remainderToTrain:
+        trainEnd = totalLines - int(totalLines * validationRatio) - int(totalLines * max(1 - trainRatio - validationRatio, 0))
     validationEnd = trainEnd + int(totalLines * validationRatio)
     
     # Split the data
@@ -123,43 +170,89 @@ def getAllSplitTriplets(finalTripletsAll, trainRatio=0.995, validationRatio=0.00
 
     return finalTripletsAllTrain, finalTripletsAllValidation, finalTripletsAllTest
 
+# Function to keep the triplets that are not in an existing set of triplets with the same IDs
+def newTriplets(triplets, existing, numEntities, numRelations):
+    triplets, existing = np.asarray(triplets).reshape(-1, 3), np.asarray(existing).reshape(-1, 3)
+    sizes = (numEntities, numRelations, numEntities)
+    keys, existingKeys = packColumns(triplets.T, sizes), packColumns(existing.T, sizes)
+    if keys is not None:
+        return triplets[~np.isin(keys, existingKeys)]
+    existingTriplets = set(map(tuple, existing.tolist()))
+    return triplets[[tuple(triplet) not in existingTriplets for triplet in triplets.tolist()]].reshape(-1, 3)
+
 if __name__ == '__main__':
-    # Extract entities, relations, and triplets from the CTD dataset
-    entitiesCTD, relationsCTD, tripletsCTD = getTripletsFromCTD('./CTD_Data/CTD_chemicals_diseases.xml')
-
-    # Load documents from the CDR dataset
-    with open('./CDR_Data/CDR.Corpus.v010516/CDR_Training+TestSet.PubTator.txt', 'r') as fp:
-        docs = pubtator.load(fp)
-
-    # Extract entities, relations, and triplets from the CDR dataset
-    entitiesCDR, relationsCDR, tripletsCDR = getTripletsFromCDR(docs, tripletsCTD)
-
-    # Combine and map entities and relations to unique numerical IDs
-    entitiesAll = entitiesCTD.union(entitiesCDR)
-    relationsAll = relationsCTD.union(relationsCDR)
-    entityToID = {entity: idx for idx, entity in enumerate(entitiesAll)}
-    relationToID = {rel: idx for idx, rel in enumerate(sorted(relationsAll))}
-
-    # Save entity and relation mappings to files
-    with open('./Knowledge_Representation/entityToID.pkl', 'wb') as f:
-        pickle.dump(entityToID, f)
-    with open('./Knowledge_Representation/relationToID.pkl', 'wb') as f:
-        pickle.dump(relationToID, f)
-
-    # Get all triplets from the CDR and CTD datasets combined
-    finalTripletsAll = getAllTriplets(tripletsCDR, tripletsCTD, entityToID, relationToID)
-    np.savetxt('./Knowledge_Representation/tripletsAll.txt', finalTripletsAll, fmt='%d %d %d')
-
-    # Split the triplets into training, validation, and test sets
-    finalTripletsAllTrain, finalTripletsAllValidation, finalTripletsAllTest  = getAllSplitTriplets(list(finalTripletsAll), trainRatio=0.995, validationRatio=0.005)
-    np.savetxt('./Knowledge_Representation/tripletsAllTrain.txt', finalTripletsAllTrain, fmt='%d %d %d')
-    np.savetxt('./Knowledge_Representation/tripletsAllValidation.txt', finalTripletsAllValidation, fmt='%d %d %d')
-    np.savetxt('./Knowledge_Representation/tripletsAllTest.txt', finalTripletsAllTest, fmt='%d %d %d')
-
-    # Get and save final triplets from the CTD dataset
-    finaltripletsCTD = getFinaltriplets(tripletsCTD, entityToID, relationToID)
-    np.savetxt('./Knowledge_Representation/tripletsCTD.txt', finaltripletsCTD, fmt='%d %d %d')
-
-    # Get and save final triplets from the CDR dataset
-    finaltripletsCDR = getFinaltriplets(tripletsCDR, entityToID, relationToID)
-    np.savetxt('./Knowledge_Representation/tripletsCDR.txt', finaltripletsCDR, fmt='%d %d %d')
\ No newline at end of file
+    # Parse the options of the CTD ingestion
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--ctd', default='./CTD_Data/CTD_chemicals_diseases.xml', help='CTD chemical-disease file, the XML file or the TSV or CSV release, optionally gzipped')
+    parser.add_argument('--workers', type=int, default=1, help='Number of processes parsing the chunks of the CTD file')
+    parser.add_argument('--bundle-dir', default='./Knowledge_Representation/bundle', help='Directory of the binary knowledge graph bundle')
+    parser.add_argument('--export-text', action='store_true', help='Also write the triplets as text files and the ID maps as pickles to Knowledge_Representation/')
+    parser.add_argument('--update', action='store_true', help='Only ingest the CTD rows and CDR documents that are new or changed since the bundle was built and add their triplets to the bundle')
+    parser.add_argument('--fresh-vocabulary', action='store_true', help='Number the entities and relations from scratch instead of keeping the IDs of the bundle or of the pickled ID maps')
+    args = parser.parse_args()
+    if args.update and args.fresh_vocabulary:
+        parser.error("--update keeps the IDs of the bundle, it cannot be used with --fresh-vocabulary")
+
+    # Keep the IDs of the entities and relations of the last build, new entities and relations get the next IDs in the order in which they are first seen
+    entityStrings, relationStrings = (None, None) if args.fresh_vocabulary else loadVocabularyStrings(args.bundle_dir, './Knowledge_Representation')
+    triplets = TripletAccumulator(Vocabulary(entityStrings or ()), Vocabulary(relationStrings or KNOWN_RELATIONS))
+
+    # Read the relations of the documents from the CDR dataset, their text and annotations are not parsed
+    docs = list(iterDocuments('./CDR_Data/CDR.Corpus.v010516/CDR_Training+TestSet.PubTator.txt', RELATIONS))
+
+    # In an update, the rows and documents of the last build are skipped and the CDR keys are looked up in the skipped CTD rows
+    bundle = KnowledgeGraphBundle(args.bundle_dir) if args.update else None
+    knownRows = bundle.hashes("ctdRows") if bundle else None
+    knownDocuments = bundle.hashes("cdrDocuments") if bundle else None
+    watchedKeys = {(relation.id1, relation.id2, relation.pmid) for doc in docs for relation in doc.relations} if bundle else None
+
+    # Extract the triplets from the CTD dataset
+    tripletsCTD, ctdRowHashes, matchedKeys = ingestCTD(args.ctd, args.workers, triplets, knownRows, watchedKeys)
+
+    # Extract the triplets from the CDR dataset, the entities and relations are added to the vocabularies of the CTD triplets
+    tripletsCDR, cdrDocumentHashes = ingestCDR(docs, tripletsCTD, knownDocuments, matchedKeys)
+
+    # The codes of the vocabularies are the numerical IDs of the entities and relations
+    entityToID = tripletsCTD.entities.codes
+    relationToID = tripletsCTD.relations.codes
+
+    # Get all triplets from the CDR and CTD datasets combined and the triplets of each dataset in one pass
+    finalTripletsAll, finaltripletsCTD, finaltripletsCDR = getTripletSets(tripletsCDR, tripletsCTD, entityToID, relationToID)
+
+    if bundle is None:
+        # Split the triplets into training, validation, and test sets
+        finalTripletsAllTrain, finalTripletsAllValidation, finalTripletsAllTest  = getAllSplitTriplets(finalTripletsAll, trainRatio=0.995, validationRatio=0.005)
+        tripletSets = {
+            "all": finalTripletsAll,
+            "train": finalTripletsAllTrain,
+            "validation": finalTripletsAllValidation,
+            "test": finalTripletsAllTest,
+            "ctd": finaltripletsCTD,
+            "cdr": finaltripletsCDR,
+        }
+        updates = []
+    else:
+        # Keep the triplets of the bundle and add the triplets that it does not have yet, the new triplets are split with the same ratios
+        # and the rounding remainder goes to training, so the new entities of a small update are trained on
+        added = {name: newTriplets(found, bundle.triplets(name), len(entityToID), len(relationToID))
+                 for name, found in (("all", finalTripletsAll), ("ctd", finaltripletsCTD), ("cdr", finaltripletsCDR))}
+        added["train"], added["validation"], added["test"] = getAllSplitTriplets(added["all"], trainRatio=0.995, validationRatio=0.005, remainderToTrain=True)
+        tripletSets = {name: np.concatenate((bundle.triplets(name), added[name])) for name in TRIPLET_SETS}
+        print(f"Added Triplets: {len(added['all'])}, Added Entities: {len(entityToID) - bundle.sizes['entities']}")
+
+        # Record the update, the embeddings of the IDs below the earlier counts stay valid and only the new IDs need new embeddings
+        # An update that adds nothing only refreshes the hashes
+        updates = [dict(update, triplets={name: bundle.updateTriplets(number, name) for name in TRIPLET_SETS}) for number, update in enumerate(bundle.updates, 1)]
+        if any(len(triplets) for triplets in added.values()) or len(entityToID) > bundle.sizes["entities"]:
+            updates.append({
+                "entities": [bundle.sizes["entities"], len(entityToID)],
+                "relations": [bundle.sizes["relations"], len(relationToID)],
+                "triplets": added,
+            })
+
+    # Save the triplet sets, the entity and relation mappings and the hashes of the rows and documents as a binary bundle
+    writeBundle(args.bundle_dir, tripletSets, entityToID, relationToID, {"ctdRows": ctdRowHashes, "cdrDocuments": cdrDocumentHashes}, updates)
+
+    # Also save the triplets as text files and the mappings as pickles if requested
+    if args.export_text:
+        exportText(KnowledgeGraphBundle(args.bundle_dir), './Knowledge_Representation')
\ No newline at end of file
@@ -0,0 +1,108 @@
+from array import array
+import numpy as np
+
+# A vocabulary that gives every string an integer code in the order in which the strings are first seen
+class Vocabulary:
+    def __init__(self, strings=()):
+        self.codes = {}                                         # Code of every string
+        self.strings = []                                       # String of every code
+        for string in strings:
+            self.encode(string)
+
+    # Returns the code of a string, a new string gets the next code
+    def encode(self, string):
+        code = self.codes.get(string)
+        if code is None:
+            code = self.codes[string] = len(self.strings)
+            self.strings.append(string)
+        return code
+
+    def __len__(self):
+        return len(self.strings)
+
+    def __contains__(self, string):
+        return string in self.codes
+
+# Function to pack integer columns into one int64 key per row, every column gets the bits needed by its number of codes
+# Returns None if the columns do not fit in 63 bits
+def packColumns(columns, sizes):
+    widths = [max(int(size - 1).bit_length(), 1) for size in sizes]
+    if sum(widths) > 63:
+        return None
+    keys = np.zeros(len(columns[0]), dtype=np.int64)
+    for column, width in zip(columns, widths):
+        keys = (keys << width) | np.asarray(column, dtype=np.int64)
+    return keys
+
+# Function to split packed keys back into their integer columns
+def unpackColumns(keys, sizes):
+    widths = [max(int(size - 1).bit_length(), 1) for size in sizes]
+    columns = []
+    for width in reversed(widths):
+        columns.append(keys & ((1 << width) - 1))
+        keys = keys >> width
+    return columns[::-1]
+
+# Triplets (head, relation, tail, pmid) kept as integer codes in growable typed arrays instead of tuples of strings
+# The vocabularies of the entities, relations and PubMed IDs can be shared between accumulators so that their codes can be compared
+class TripletAccumulator:
+    def __init__(self, entities=None, relations=None, pmids=None):
+        self.entities = entities if entities is not None else Vocabulary()     # Vocabulary of the chemicals and diseases
+        self.relations = relations if relations is not None else Vocabulary()  # Vocabulary of the relations
+        self.pmids = pmids if pmids is not None else Vocabulary()              # Vocabulary of the PubMed IDs
+        self.heads = array('i')                                 # Entity code of the chemical of every triplet
+        self.relationCodes = array('i')                         # Relation code of every triplet
+        self.tails = array('i')                                 # Entity code of the disease of every triplet
+        self.pmidCodes = array('i')                             # PubMed ID code of every triplet
+
+    # Returns an empty accumulator sharing the vocabularies of this one
+    def sibling(self):
+        return TripletAccumulator(self.entities, self.relations, self.pmids)
+
+    # Adds the triplets of a relation between two entities found in several PubMed articles
+    def add(self, head, relation, tail, pmids):
+        headCode = self.entities.encode(head)
+        relationCode = self.relations.encode(relation)
+        tailCode = self.entities.encode(tail)
+        for pmid in pmids:
+            self.heads.append(headCode)
+            self.relationCodes.append(relationCode)
+            self.tails.append(tailCode)
+            self.pmidCodes.append(self.pmids.encode(pmid))
+
+    # Adds a triplet whose entities and PubMed ID are already codes of the vocabularies
+    def addCodes(self, headCode, relation, tailCode, pmidCode):
+        self.heads.append(headCode)
+        self.relationCodes.append(self.relations.encode(relation))
+        self.tails.append(tailCode)
+        self.pmidCodes.append(pmidCode)
+
+    def __len__(self):
+        return len(self.heads)
+
+    # Returns the (head, relation, tail, pmid) columns as numpy arrays sharing the memory of the accumulator
+    def columns(self):
+        return tuple(np.frombuffer(column, dtype=np.int32) if len(column) else np.zeros(0, dtype=np.int32)
+                     for column in (self.heads, self.relationCodes, self.tails, self.pmidCodes))
+
+    # Removes the repeated triplets, the triplets are left sorted by (head, tail, pmid, relation)
+    def deduplicate(self):
+        heads, relations, tails, pmids = self.columns()
+        keys = packColumns((heads, tails, pmids, relations), (len(self.entities), len(self.entities), len(self.pmids), len(self.relations)))
+        if keys is not None:
+            _, first = np.unique(keys, return_index=True)
+        else:
+            _, first = np.unique(np.stack((heads, tails, pmids, relations), axis=1), axis=0, return_index=True)
+        self.heads, self.relationCodes, self.tails, self.pmidCodes = (array('i', column[first].tobytes()) for column in (heads, relations, tails, pmids))
+
+    # Returns a boolean mask of the (head, tail, pmid) keys that are keys of triplets of the accumulator
+    # The keys must be codes of the same vocabularies
+    def containsKeys(self, heads, tails, pmids):
+        ownHeads, _, ownTails, ownPmids = self.columns()
+        sizes = (len(self.entities), len(self.entities), len(self.pmids))
+        ownKeys = packColumns((ownHeads, ownTails, ownPmids), sizes)
+        keys = packColumns((heads, tails, pmids), sizes)
+        if keys is not None:
+            return np.isin(keys, ownKeys)
+        ownKeys = set(zip(ownHeads.tolist(), ownTails.tolist(), ownPmids.tolist()))
+        return np.array([key in ownKeys for key in zip(heads, tails, pmids)], dtype=bool)